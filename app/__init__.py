@@ -1,6 +1,6 @@
 from flask import Flask
 from config import Config
-from app.extensions import db
+from app.extensions import db, frames, contours, datasets, metrics, live
 
 from app.main import bp as main_bp
 from app.profiles import bp as profiles_bp
@@ -8,6 +8,8 @@ from app.configuration import bp as configuration_bp
 from app.run import bp as run_bp
 from app.plot import bp as plot_bp
 from app.cli import bp as cli_bp
+from app.plot.prerender import prerender
+from app.run.jobs import runner
 
 def create_app(config_class=Config):
     app = Flask(__name__)
@@ -15,6 +17,13 @@ def create_app(config_class=Config):
 
     # Initialize Flask extensions here
     db.init_app(app)
+    frames.init_app(app)
+    contours.init_app(app)
+    datasets.init_app(app)
+    metrics.init_app(app)
+    live.init_app(app)
+    prerender.init_app(app)
+    runner.init_app(app)
 
     # Register blueprints here
     app.register_blueprint(main_bp)
@@ -1,2 +1,11 @@
 from flask_sqlalchemy import SQLAlchemy
+from app.fall3d.cache import FrameCache
+from app.fall3d.registry import DatasetRegistry
+from app.fall3d.metrics import RenderMetrics
+from app.fall3d.live import LiveWatcher
 db = SQLAlchemy()
+frames = FrameCache(subdir='frames', suffix='.png')
+contours = FrameCache(subdir='contours', suffix='.json')
+datasets = DatasetRegistry()
+metrics = RenderMetrics()
+live = LiveWatcher()
@@ -1 +1,6 @@
-from app.fall3d.post import Fall3D
+def __getattr__(name):
+    # Fall3D pulls in xarray: import it on first use only
+    if name == 'Fall3D':
+        from app.fall3d.post import Fall3D
+        return Fall3D
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
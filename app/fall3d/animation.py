@@ -0,0 +1,115 @@
+import io
+import shutil
+import struct
+import subprocess
+from app.fall3d.png import SIGNATURE, chunk, read_chunks
+
+FORMATS = {'gif':  'image/gif',
+           'apng': 'image/apng',
+           'mp4':  'video/mp4'}
+
+def available_formats():
+    """Animation formats supported on this host."""
+    formats = ['gif','apng']
+    if shutil.which('ffmpeg') is not None:
+        formats.append('mp4')
+    return formats
+
+def get_writer(fmt,fname,nframes,fps=4):
+    if fmt == 'apng':
+        return APNGWriter(open(fname,'wb'),nframes,fps)
+    elif fmt == 'gif':
+        return GIFWriter(open(fname,'wb'),fps)
+    elif fmt == 'mp4':
+        return FFmpegWriter(fname,fps)
+    raise ValueError(f"Unknown animation format: {fmt}")
+
+class APNGWriter:
+    """Streaming animated PNG encoder.
+
+    The compressed image data of each PNG frame is copied as-is into the
+    animation, so frames are neither decoded nor kept in memory. All the
+    frames must have the same size and colour type.
+    """
+    def __init__(self,fp,nframes,fps=4):
+        self.fp      = fp
+        self.nframes = nframes
+        self.delay   = (1,fps)
+        self.seq     = 0
+        self.ihdr    = None
+
+    def add(self,png):
+        ihdr = None
+        idat = []
+        for tag, data in read_chunks(png):
+            if tag == b'IHDR':
+                ihdr = data
+            elif tag == b'IDAT':
+                idat.append(data)
+        first = self.ihdr is None
+        if first:
+            self.ihdr = ihdr
+            self.fp.write(SIGNATURE)
+            self.fp.write(chunk(b'IHDR',ihdr))
+            self.fp.write(chunk(b'acTL',struct.pack('>II',self.nframes,0)))
+        elif ihdr != self.ihdr:
+            raise ValueError("All frames must have the same size")
+        (width,height) = struct.unpack('>II',ihdr[:8])
+        fctl = struct.pack('>IIIIIHHBB',
+                           self.seq, width, height, 0, 0,
+                           self.delay[0], self.delay[1], 0, 0)
+        self.fp.write(chunk(b'fcTL',fctl))
+        self.seq += 1
+        for data in idat:
+            if first:
+                # The first frame is also the default image
+                self.fp.write(chunk(b'IDAT',data))
+            else:
+                self.fp.write(chunk(b'fdAT',struct.pack('>I',self.seq)+data))
+                self.seq += 1
+
+    def close(self):
+        self.fp.write(chunk(b'IEND',b''))
+        self.fp.close()
+
+class GIFWriter:
+    """Streaming GIF encoder: each frame is quantized with its own palette."""
+    def __init__(self,fp,fps=4):
+        self.fp       = fp
+        self.duration = int(1000/fps)
+        self.first    = True
+
+    def add(self,png):
+        from PIL import Image, GifImagePlugin
+        im = Image.open(io.BytesIO(png)).convert('RGB').quantize(colors=256)
+        if self.first:
+            header, _ = GifImagePlugin.getheader(im, info={'loop': 0})
+            self.fp.write(b''.join(header))
+            self.first = False
+        for data in GifImagePlugin.getdata(im,
+                                           duration=self.duration,
+                                           include_color_table=True):
+            self.fp.write(data)
+
+    def close(self):
+        self.fp.write(b';')
+        self.fp.close()
+
+class FFmpegWriter:
+    """Pipe PNG frames into a local ffmpeg process."""
+    def __init__(self,fname,fps=4):
+        cmd = ['ffmpeg', '-loglevel', 'error', '-y',
+               '-f', 'image2pipe', '-framerate', str(fps), '-i', '-',
+               '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2',
+               '-c:v', 'libx264', '-pix_fmt', 'yuv420p',
+               '-f', 'mp4', '-movflags', '+faststart',
+               fname]
+        self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+
+    def add(self,png):
+        self.proc.stdin.write(png)
+
+    def close(self):
+        self.proc.stdin.close()
+        if self.proc.wait() != 0:
+            raise RuntimeError("ffmpeg failed to encode the animation")
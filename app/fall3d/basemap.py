@@ -0,0 +1,84 @@
+import threading
+
+_basemaps = {}
+_lock     = threading.Lock()
+
+def get_basemap(extent,proj='PlateCarree'):
+    """Return the base map for a domain extent, building it only once."""
+    index = (tuple(round(float(v),6) for v in extent), proj)
+    with _lock:
+        basemap = _basemaps.get(index)
+        if basemap is None:
+            basemap = Basemap(*index)
+            _basemaps[index] = basemap
+    return basemap
+
+class Basemap:
+    """Natural Earth land and borders clipped and simplified to a domain.
+
+    Reading and projecting the 10m shapefiles is identical for every frame
+    of a run, so the geometries are prepared once per extent and reused
+    by each figure.
+    """
+    def __init__(self,extent,proj='PlateCarree',pad=0.05):
+        import cartopy.crs as crs
+        self.extent = extent
+        self.proj   = getattr(crs,proj)()
+        self.crs    = crs.PlateCarree()
+
+        (lonmin,lonmax,latmin,latmax) = extent
+        dlon = pad*(lonmax-lonmin)
+        dlat = pad*(latmax-latmin)
+        self.bbox = (lonmin-dlon, latmin-dlat, lonmax+dlon, latmax+dlat)
+        # Simplification tolerance of about 1/1000 of the domain size
+        self.tolerance = 1E-3 * max(lonmax-lonmin, latmax-latmin)
+
+        self.land    = self._load('physical', 'land')
+        self.borders = self._load('cultural', 'admin_0_countries', boundary=True)
+
+    def _load(self,category,name,boundary=False):
+        import cartopy.io.shapereader as shpreader
+        from shapely.geometry import box
+        bbox = box(*self.bbox)
+        fname = shpreader.natural_earth(resolution='10m',
+                                        category=category,
+                                        name=name)
+        geometries = []
+        for geom in shpreader.Reader(fname).geometries():
+            if not geom.intersects(bbox): continue
+            if boundary: geom = geom.boundary
+            geom = geom.intersection(bbox).simplify(self.tolerance, preserve_topology=True)
+            if not geom.is_empty:
+                geometries.append(geom)
+        return geometries
+
+    def draw(self,ax):
+        """Draw the cached background on a GeoAxes."""
+        ax.set_extent(self.extent, crs=self.crs)
+        ax.add_geometries(self.land,
+                          crs       = self.crs,
+                          edgecolor = 'none',
+                          facecolor = 'lightgrey',
+                          alpha     = 0.8,
+                          zorder    = 0)
+        ax.add_geometries(self.borders,
+                          crs       = self.crs,
+                          edgecolor = 'gray',
+                          facecolor = 'none',
+                          linewidth = 0.4)
+        ###
+        ### Add grid lines
+        ###
+        gl = ax.gridlines(
+            crs         = self.crs,
+            draw_labels = True,
+            linewidth   = 0.5,
+            color       = 'gray',
+            alpha       = 0.5,
+            linestyle   = '--')
+        gl.top_labels    = False
+        gl.right_labels  = False
+        gl.xlabel_style  = {'fontsize': 7}
+        gl.ylabel_style  = {'fontsize': 7,
+                            'rotation': 90}
+        return gl
@@ -0,0 +1,150 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+def make_token(*args):
+    """Return a short stable hash for a tuple of values."""
+    return hashlib.sha1(repr(args).encode()).hexdigest()[:20]
+
+class FrameCache:
+    """Two-tier LRU cache for rendered outputs (PNG frames, etc).
+
+    Entries are keyed by the identity of the output file (path, mtime, size)
+    and by an arbitrary hashable key. The memory tier is shared by the
+    whole process, while the disk tier lives under the run folder:
+
+        <run_folder>/.cache/<subdir>/<file token>/<key token><suffix>
+
+    Both tiers are bounded by a size budget in bytes. When the output file
+    changes, entries of the previous version are dropped. Live identities
+    (see Fall3D.file_id) are tracked apart from the others, so live and
+    regular views of the same output don't drop each other's entries.
+    """
+    def __init__(self, max_memory=64*2**20, max_disk=512*2**20, subdir='frames', suffix='.png'):
+        self.max_memory = max_memory
+        self.max_disk   = max_disk
+        self.subdir     = subdir
+        self.suffix     = suffix
+
+        self._mem       = OrderedDict()
+        self._mem_size  = 0
+        self._files     = {}
+        self._lock      = threading.RLock()
+
+    def init_app(self,app):
+        prefix = self.subdir.upper()
+        self.max_memory = app.config.get(f'{prefix}_CACHE_MEMORY', self.max_memory)
+        self.max_disk   = app.config.get(f'{prefix}_CACHE_DISK',   self.max_disk)
+
+    def folder(self,path,file_id=None):
+        folder = os.path.join(path,'.cache',self.subdir)
+        if file_id is None:
+            return folder
+        return os.path.join(folder,make_token(*file_id))
+
+    def get(self,path,file_id,key):
+        """Return the cached bytes or None."""
+        self._check_file(path,file_id)
+        mkey = (file_id,key)
+        with self._lock:
+            data = self._mem.get(mkey)
+            if data is not None:
+                self._mem.move_to_end(mkey)
+                return data
+        fname = os.path.join(self.folder(path,file_id), make_token(key)+self.suffix)
+        try:
+            with open(fname,'rb') as f:
+                data = f.read()
+            os.utime(fname)
+        except OSError:
+            return None
+        self._put_memory(mkey,data)
+        return data
+
+    def put(self,path,file_id,key,data):
+        self._check_file(path,file_id)
+        self._put_memory((file_id,key),data)
+        if self.max_disk <= 0:
+            return
+        folder = self.folder(path,file_id)
+        fname  = os.path.join(folder, make_token(key)+self.suffix)
+        try:
+            os.makedirs(folder, exist_ok=True)
+            # Write atomically: several workers may render the same frame
+            tmp = f"{fname}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp,'wb') as f:
+                f.write(data)
+            os.replace(tmp,fname)
+        except OSError as e:
+            print(f"Cache write failed: {e}")
+            return
+        self._evict_disk(folder)
+
+    def contains(self,path,file_id,key):
+        if (file_id,key) in self._mem:
+            return True
+        fname = os.path.join(self.folder(path,file_id), make_token(key)+self.suffix)
+        return os.path.isfile(fname)
+
+    def clear(self,path):
+        """Remove every entry stored for a run folder."""
+        with self._lock:
+            for mkey in [k for k in self._mem if k[0][0].startswith(path)]:
+                self._mem_size -= len(self._mem.pop(mkey))
+        self._remove_tree(self.folder(path))
+
+    def _put_memory(self,mkey,data):
+        if len(data) > self.max_memory:
+            return
+        with self._lock:
+            old = self._mem.pop(mkey,None)
+            if old is not None:
+                self._mem_size -= len(old)
+            self._mem[mkey] = data
+            self._mem_size += len(data)
+            while self._mem_size > self.max_memory:
+                _, item = self._mem.popitem(last=False)
+                self._mem_size -= len(item)
+
+    def _check_file(self,path,file_id):
+        """Drop entries of a previous version of the same output file."""
+        index = (file_id[0], file_id[1] == 'live')
+        with self._lock:
+            previous = self._files.get(index)
+            self._files[index] = file_id
+            if previous is None or previous == file_id:
+                return
+            for mkey in [k for k in self._mem if k[0] == previous]:
+                self._mem_size -= len(self._mem.pop(mkey))
+        self._remove_tree(self.folder(path,previous))
+
+    def _evict_disk(self,folder):
+        """Remove least recently used files until the disk budget is met."""
+        root = os.path.dirname(folder)
+        entries = []
+        total = 0
+        for dirpath, _, fnames in os.walk(root):
+            for fname in fnames:
+                fname = os.path.join(dirpath,fname)
+                try:
+                    st = os.stat(fname)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime,st.st_size,fname))
+                total += st.st_size
+        if total <= self.max_disk:
+            return
+        entries.sort()
+        for _, size, fname in entries:
+            if total <= self.max_disk: break
+            try:
+                os.remove(fname)
+                total -= size
+            except OSError:
+                pass
+
+    @staticmethod
+    def _remove_tree(folder):
+        import shutil
+        shutil.rmtree(folder, ignore_errors=True)
@@ -0,0 +1,191 @@
+import io
+import numpy as np
+from app.fall3d.post import interp_weights
+from app.fall3d.basemap import get_basemap
+
+MODES = {'side':  'Side by side',
+         'diff':  'Difference (B - A)',
+         'ratio': 'Ratio (B / A)'}
+
+# Levels of the ratio maps (symmetric in log scale around 1)
+RATIO_LEVELS = [0.1, 0.2, 0.5, 0.8, 1.25, 2, 5, 10]
+
+class Regridder:
+    """Separable bilinear interpolation from a source to a target lat/lon grid.
+
+    The weights are computed once; points of the target grid outside the
+    source grid get NaN.
+    """
+    def __init__(self,src_lon,src_lat,dst_lon,dst_lat):
+        self.identity = (np.array_equal(src_lon,dst_lon) and
+                         np.array_equal(src_lat,dst_lat))
+        if self.identity:
+            return
+        (self.i0, self.wx, okx) = interp_weights(src_lon,dst_lon)
+        (self.j0, self.wy, oky) = interp_weights(src_lat,dst_lat)
+        self.outside = ~(oky[:,None] & okx[None,:])
+
+    def __call__(self,field):
+        field = np.asarray(field)
+        if self.identity:
+            return field
+        i0, j0 = self.i0, self.j0
+        wx, wy = self.wx[None,:], self.wy[:,None]
+        lower = field[j0][:,i0]*(1-wx)   + field[j0][:,i0+1]*wx
+        upper = field[j0+1][:,i0]*(1-wx) + field[j0+1][:,i0+1]*wx
+        out = lower*(1-wy) + upper*wy
+        out[self.outside] = np.nan
+        return out
+
+class Comparison:
+    """Comparison of a variable between two outputs (run A and run B).
+
+    Times are matched by value and run B is regridded to the grid of
+    run A if needed. Fields are read lazily, one frame at a time, using
+    the variable and level of the render settings of run A.
+    """
+    def __init__(self,a,b,labels=('A','B')):
+        self.a      = a
+        self.b      = b
+        self.labels = labels
+        self.key    = a.key
+        b.level     = a.level
+        if self.key not in b.get_vars():
+            raise KeyError(f"{self.key} not found in {b.filepath}")
+        ta = a.ds['time'].values if not a.is_derived(self.key) else np.array([0])
+        tb = b.ds['time'].values if not b.is_derived(self.key) else np.array([0])
+        (self.time, self.ia, self.ib) = np.intersect1d(ta, tb, return_indices=True)
+        self.regrid = Regridder(b.ds.lon.values, b.ds.lat.values,
+                                a.ds.lon.values, a.ds.lat.values)
+
+    def __len__(self):
+        return len(self.time)
+
+    def get_times(self):
+        """Labels of the matching times."""
+        if self.a.is_derived(self.key):
+            return ['Whole run']
+        return [str(t)[:16].replace('T',' ') for t in self.time.astype('datetime64[m]')]
+
+    def fields(self,k):
+        """Fields of both runs at the k-th matching time on the grid of run A."""
+        fa = np.asarray(self.a.get_field(self.key,int(self.ia[k])).values, dtype=np.float64)
+        fb = np.asarray(self.b.get_field(self.key,int(self.ib[k])).values, dtype=np.float64)
+        return fa, self.regrid(fb)
+
+    def difference(self,k):
+        fa, fb = self.fields(k)
+        return fb - fa
+
+    def ratio(self,k):
+        fa, fb = self.fields(k)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(fa > 0, fb/fa, np.nan)
+
+    def threshold(self):
+        """Threshold of the plume area used by the figure of merit in space."""
+        levels = self.a.get_levels()
+        positive = [l for l in levels or [] if l > 0]
+        return positive[0] if positive else 0.0
+
+    def summary(self,k,threshold=None):
+        """Metrics of the k-th matching time.
+
+        bias, mae, rmse and max_abs are computed over the points valid in
+        both runs; fms is the figure of merit in space (intersection over
+        union of the areas above the threshold).
+        """
+        if threshold is None:
+            threshold = self.threshold()
+        fa, fb = self.fields(k)
+        valid = np.isfinite(fa) & np.isfinite(fb)
+        a, b = fa[valid], fb[valid]
+        d = b - a
+        out = {'time': self.get_times()[k]}
+        if d.size == 0:
+            return out
+        union = np.count_nonzero((a > threshold) | (b > threshold))
+        inter = np.count_nonzero((a > threshold) & (b > threshold))
+        out.update({'bias':    float(d.mean()),
+                    'mae':     float(np.abs(d).mean()),
+                    'rmse':    float(np.sqrt((d*d).mean())),
+                    'max_abs': float(np.abs(d).max()),
+                    'sum_a':   float(a.sum()),
+                    'sum_b':   float(b.sum()),
+                    'fms':     inter/union if union else None})
+        if a.std() > 0 and b.std() > 0:
+            out['corr'] = float(np.corrcoef(a,b)[0,1])
+        return out
+
+    def metrics(self,threshold=None):
+        if threshold is None:
+            threshold = self.threshold()
+        return [self.summary(k,threshold) for k in range(len(self))]
+
+    def plot(self,k,mode='diff'):
+        """Render side-by-side, difference or ratio maps as PNG (BytesIO)."""
+        import matplotlib
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.colors import BoundaryNorm
+        import cartopy.crs as crs
+        from app.fall3d.tiles import auto_levels
+        a = self.a
+        basemap = get_basemap(a.get_extent())
+        fa, fb = self.fields(k)
+        lon, lat = a.ds.lon.values, a.ds.lat.values
+        label = a.ds[self.key].attrs.get('long_name',self.key) if not a.is_derived(self.key) \
+                else a.derived[self.key].attrs.get('long_name',self.key)
+        time = self.get_times()[k]
+        levels = a.get_levels() or auto_levels(0.0,float(np.nanmax([np.nanmax(fa),np.nanmax(fb)])))
+
+        if mode == 'side':
+            fig = Figure(figsize=(11,4.8))
+            FigureCanvasAgg(fig)
+            cmap = matplotlib.colormaps['RdYlBu_r']
+            axes = [fig.add_subplot(1,2,i+1,projection=basemap.proj) for i in range(2)]
+            for ax, field, name in zip(axes,(fa,fb),self.labels):
+                basemap.draw(ax)
+                fc = ax.contourf(lon,lat,field,
+                                 levels    = levels,
+                                 norm      = BoundaryNorm(levels,cmap.N),
+                                 cmap      = cmap,
+                                 extend    = 'max',
+                                 transform = crs.PlateCarree())
+                ax.set_title(name, loc='left')
+                ax.set_title(time, loc='right')
+            fig.colorbar(fc, ax=axes, orientation='vertical', label=label)
+        else:
+            fig = Figure()
+            FigureCanvasAgg(fig)
+            ax = fig.add_subplot(projection=basemap.proj)
+            basemap.draw(ax)
+            if mode == 'diff':
+                field = fb - fa
+                # Symmetric levels with the spacing of the plot levels
+                upper = [l for l in levels if l > 0]
+                if not upper:
+                    upper = [l for l in auto_levels(0.0,float(np.nanmax(np.abs(field)))) if l > 0] or [1.0]
+                levels = [-l for l in reversed(upper)] + upper
+                cmap = matplotlib.colormaps['RdBu_r']
+                title = f"{self.labels[1]} - {self.labels[0]}"
+            else:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    field = np.where(fa > 0, fb/fa, np.nan)
+                levels = RATIO_LEVELS
+                cmap = matplotlib.colormaps['PuOr_r']
+                title = f"{self.labels[1]} / {self.labels[0]}"
+            fc = ax.contourf(lon,lat,field,
+                             levels    = levels,
+                             norm      = BoundaryNorm(levels,cmap.N,extend='both'),
+                             cmap      = cmap,
+                             extend    = 'both',
+                             transform = crs.PlateCarree())
+            ax.set_title(title, loc='left')
+            ax.set_title(time, loc='right')
+            fig.colorbar(fc, orientation='vertical', label=label)
+
+        buf = io.BytesIO()
+        fig.savefig(buf, format='png')
+        buf.seek(0)
+        return buf
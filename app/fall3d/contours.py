@@ -0,0 +1,56 @@
+import json
+
+# Decimal places of the exported coordinates (~1 m)
+PRECISION = 5
+
+def _round(coords):
+    if isinstance(coords[0],(list,tuple)):
+        return [_round(c) for c in coords]
+    return [round(c,PRECISION) for c in coords]
+
+def contour_bands(da,levels,tolerance=0.0):
+    """Filled contour bands of a 2D (lat,lon) DataArray as shapely geometries.
+
+    Bands are computed with contourpy (no figure is created) between
+    consecutive levels, plus an open band above the last level as with
+    extend='max'. Returns a list of (lower,upper,geometry), where the
+    geometries are simplified to the tolerance (in degrees) when given.
+    """
+    import numpy as np
+    from contourpy import contour_generator, FillType
+    from shapely.geometry import Polygon, MultiPolygon
+    z = np.ma.masked_invalid(np.asarray(da.values,dtype=np.float64))
+    gen = contour_generator(da.lon.values, da.lat.values, z,
+                            fill_type=FillType.OuterOffset)
+    bounds = list(zip(levels[:-1],levels[1:])) + [(levels[-1],np.inf)]
+    bands = []
+    for lower, upper in bounds:
+        points, offsets = gen.filled(lower, upper if np.isfinite(upper) else np.finfo(np.float64).max)
+        polygons = []
+        for xy, offset in zip(points,offsets):
+            rings = [xy[i:j] for i,j in zip(offset[:-1],offset[1:])]
+            polygons.append(Polygon(rings[0],rings[1:]))
+        if not polygons:
+            continue
+        geometry = MultiPolygon(polygons)
+        if tolerance > 0:
+            geometry = geometry.simplify(tolerance, preserve_topology=True)
+        if not geometry.is_empty:
+            bands.append((float(lower), float(upper), geometry))
+    return bands
+
+def encode_geojson(bands,properties=None):
+    """GeoJSON FeatureCollection (bytes) of contour bands with level attributes."""
+    from shapely.geometry import mapping
+    features = []
+    for lower, upper, geometry in bands:
+        geometry = mapping(geometry)
+        geometry['coordinates'] = _round(geometry['coordinates'])
+        features.append({'type':       'Feature',
+                         'geometry':   geometry,
+                         'properties': {'lower': lower,
+                                        'upper': None if upper == float('inf') else upper}})
+    collection = {'type':       'FeatureCollection',
+                  'properties': dict(properties or {}),
+                  'features':   features}
+    return json.dumps(collection, separators=(',',':')).encode()
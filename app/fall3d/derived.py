@@ -0,0 +1,127 @@
+import os
+import threading
+
+SUFFIXES = ('_tmax','_tint','_arrival')
+
+def derived_path(path,fname):
+    """Derived dataset stored next to the output (config.res.nc -> config.res.derived.nc)."""
+    root, ext = os.path.splitext(fname)
+    return os.path.join(path,f'{root}.derived{ext}')
+
+def compute_derived(f,threshold=0.0):
+    """Compute temporal summaries of every (time,lat,lon) variable.
+
+    In a single pass over the time axis, it computes for each variable:
+      <key>_tmax:    maximum over time
+      <key>_tint:    time-integrated value (trapezoidal rule, in units*s)
+      <key>_arrival: first time (hours after the first output time)
+                     at which the value exceeds the threshold
+    The result is written next to the output file and tagged with the
+    output mtime so that it is discarded when the output changes.
+    """
+    import numpy as np
+    import xarray as xr
+    ds   = f.ds
+    keys = f.get_vars(derived=False,levels=False)
+    time = ds['time'].values
+    seconds = (time - time[0]) / np.timedelta64(1,'s')
+    shape = (ds.sizes['lat'],ds.sizes['lon'])
+
+    tmax    = {k: np.full(shape,-np.inf) for k in keys}
+    tint    = {k: np.zeros(shape) for k in keys}
+    arrival = {k: np.full(shape,np.nan) for k in keys}
+    prev    = {}
+    for it in f.get_times():
+        for k in keys:
+            field = np.asarray(f.get_field(k,it).values,dtype=np.float64)
+            np.fmax(tmax[k],field,out=tmax[k])
+            if it > 0:
+                tint[k] += 0.5*(prev[k]+field)*(seconds[it]-seconds[it-1])
+            first = np.isnan(arrival[k]) & (field > threshold)
+            arrival[k][first] = seconds[it]/3600.0
+            prev[k] = field
+
+    out = {}
+    dims = ('lat','lon')
+    for k in keys:
+        tmax[k][np.isinf(tmax[k])] = np.nan
+        attrs = ds[k].attrs
+        name  = attrs.get('long_name',k)
+        units = attrs.get('units','')
+        out[f'{k}_tmax'] = (dims, tmax[k].astype(np.float32),
+                            {'long_name': f'{name} (maximum over time)',
+                             'units': units})
+        out[f'{k}_tint'] = (dims, tint[k].astype(np.float32),
+                            {'long_name': f'{name} (time integrated)',
+                             'units': f'{units} s'.strip()})
+        out[f'{k}_arrival'] = (dims, arrival[k].astype(np.float32),
+                               {'long_name': f'{name} arrival time (> {threshold:g})',
+                                'units': 'h',
+                                'threshold': threshold})
+    st = os.stat(f.filepath)
+    attrs = {'source_mtime': str(st.st_mtime_ns),
+             'source_size':  str(st.st_size),
+             'threshold':    threshold}
+    fname = derived_path(f.path,f.fname)
+    tmp = f'{fname}.tmp'
+    xr.Dataset(out,coords={'lat': ds.lat,'lon': ds.lon},attrs=attrs).to_netcdf(tmp)
+    os.replace(tmp,fname)
+    return fname
+
+def open_derived(path,fname):
+    """Open the derived dataset of an output if it is up to date."""
+    import xarray as xr
+    fname_derived = derived_path(path,fname)
+    if not os.path.isfile(fname_derived):
+        return None
+    st = os.stat(os.path.join(path,fname))
+    ds = xr.open_dataset(fname_derived)
+    if ds.attrs.get('source_mtime') != str(st.st_mtime_ns) or ds.attrs.get('source_size') != str(st.st_size):
+        ds.close()
+        return None
+    return ds
+
+class DerivedJobs:
+    """Compute derived products in background threads, one per output.
+
+    The output is read by its own (lazy) dataset; when the products are
+    written, the shared dataset is reopened and its index rebuilt.
+    """
+    def __init__(self):
+        self._status = {}
+        self._lock   = threading.Lock()
+
+    def start(self,path,fname,threshold=0.0):
+        index = (path,fname)
+        with self._lock:
+            if self._status.get(index) == 'running':
+                return False
+            self._status[index] = 'running'
+        def target():
+            from app.extensions import datasets
+            from app.fall3d.index import invalidate_index
+            from app.fall3d.post import Fall3D
+            try:
+                f = Fall3D(path,fname,lazy=True)
+                if not f.load():
+                    raise ValueError(f"Cannot read {fname}")
+                try:
+                    compute_derived(f,threshold)
+                finally:
+                    f.close()
+                # Reopen the output and rebuild its index with the new variables
+                datasets.close(path,fname)
+                invalidate_index(path,fname)
+                status = 'finished'
+            except Exception as e:
+                print(f"Derived products failed: {e}")
+                status = f'failed: {e}'
+            with self._lock:
+                self._status[index] = status
+        threading.Thread(target=target,daemon=True).start()
+        return True
+
+    def status(self,path,fname):
+        return self._status.get((path,fname))
+
+derived_jobs = DerivedJobs()
@@ -0,0 +1,149 @@
+import os
+import glob
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+ENSEMBLE_FILE = 'config.ens.nc'
+
+def find_members(path,fname='config.res.nc'):
+    """Outputs of the ensemble members (subfolders 0001, 0002, ...)."""
+    members = glob.glob(os.path.join(path,'[0-9][0-9][0-9][0-9]',fname))
+    return sorted(members)
+
+def prob_name(key,threshold):
+    return f"{key}_prob_{threshold:g}".replace('.','_').replace('-','m').replace('+','')
+
+# Member datasets opened once by each worker process (see _open_members)
+_datasets = None
+
+def _open_members(members):
+    global _datasets
+    import xarray as xr
+    _datasets = [xr.open_dataset(m, cache=False) for m in members]
+
+def _reduce(key,times,thresholds,percentiles):
+    """Ensemble statistics of a variable for a chunk of time steps.
+
+    Members are read one at a time into a buffer holding a single time
+    step, so memory is bounded by nens frames per worker.
+    """
+    import numpy as np
+    shape = _datasets[0][key].shape[1:]
+    nt = len(times)
+    buf  = np.empty((len(_datasets),)+shape, dtype=np.float32)
+    mean = np.empty((nt,)+shape, dtype=np.float32)
+    pct  = np.empty((len(percentiles),nt)+shape, dtype=np.float32)
+    prob = np.empty((len(thresholds),nt)+shape, dtype=np.float32)
+    for k,it in enumerate(times):
+        for m,ds in enumerate(_datasets):
+            buf[m] = ds[key].isel(time=it).values
+        mean[k] = buf.mean(axis=0)
+        if percentiles:
+            pct[:,k] = np.percentile(buf,percentiles,axis=0)
+        for i,thr in enumerate(thresholds):
+            prob[i,k] = (buf>thr).mean(axis=0)
+    return key, times, mean, pct, prob
+
+def compute_ensemble(path,thresholds,percentiles,fname='config.res.nc',
+                     output=ENSEMBLE_FILE,max_workers=None,chunk=8):
+    """Write mean, percentile and exceedance-probability fields of every
+    (time,lat,lon) variable of the ensemble members to a NetCDF file.
+
+    The reduction is split in chunks of time steps computed in parallel
+    by workers that open the members once. The output variables are
+    created up front and each chunk is written as soon as it is ready,
+    with at most two chunks per worker in flight, so memory does not
+    grow with the length of the run.
+    """
+    import netCDF4
+    import xarray as xr
+    from concurrent.futures import wait, FIRST_COMPLETED
+    from app.fall3d.post import Fall3D
+    members = find_members(path,fname)
+    if not members:
+        raise ValueError("No ensemble members found")
+    thresholds  = sorted(float(t) for t in thresholds)
+    percentiles = sorted(float(q) for q in percentiles)
+
+    ref = Fall3D(os.path.dirname(members[0]),fname,lazy=True)
+    if not ref.load():
+        raise ValueError(f"Cannot read {members[0]}")
+    coords = {c: ref.ds[c] for c in ('time','lat','lon')}
+    keys   = ref.get_vars(derived=False,levels=False)
+    nt     = ref.ds.sizes['time']
+    shape  = (1, ref.ds.sizes['lat'], ref.ds.sizes['lon'])
+    attrs  = {key: dict(ref.ds[key].attrs) for key in keys}
+    ref.close()
+
+    fname_out = os.path.join(path,output)
+    tmp = f'{fname_out}.tmp'
+    xr.Dataset(coords=coords,attrs={'members': len(members)}).to_netcdf(tmp,mode='w')
+    dims = ('time','lat','lon')
+    with netCDF4.Dataset(tmp,'a') as nc:
+        # Output variables of each key: mean, percentiles, probabilities
+        outputs = {}
+        for key in keys:
+            name = attrs[key].get('long_name',key)
+            items = [(f'{key}_mean', {**attrs[key], 'long_name': f"{name} (ensemble mean)"})]
+            items += [(f'{key}_p{q:g}', {**attrs[key], 'long_name': f"{name} ({q:g}th percentile)"})
+                      for q in percentiles]
+            items += [(prob_name(key,thr), {'units':     '1',
+                                            'threshold': thr,
+                                            'long_name': f"Probability of {name} > {thr:g}"})
+                      for thr in thresholds]
+            outputs[key] = []
+            for (var, var_attrs) in items:
+                v = nc.createVariable(var,'f4',dims,chunksizes=shape)
+                v.setncatts(var_attrs)
+                outputs[key].append(v)
+
+        def write(task):
+            (key, times, mean, pct, prob) = task.result()
+            window = slice(times[0],times[-1]+1)
+            for v, data in zip(outputs[key],[mean,*pct,*prob]):
+                v[window] = data
+
+        tasks = [(key,list(range(i,min(i+chunk,nt)))) for key in keys for i in range(0,nt,chunk)]
+        window = 2*(max_workers or os.cpu_count() or 1)
+        pending = set()
+        with ProcessPoolExecutor(max_workers=max_workers,
+                                 initializer=_open_members,
+                                 initargs=(members,)) as executor:
+            for key, times in tasks:
+                pending.add(executor.submit(_reduce,key,times,thresholds,percentiles))
+                if len(pending) >= window:
+                    done, pending = wait(pending,return_when=FIRST_COMPLETED)
+                    for task in done:
+                        write(task)
+            for task in pending:
+                write(task)
+    os.replace(tmp,fname_out)
+    return fname_out
+
+class EnsembleJobs:
+    """Run ensemble post-processing in background threads, one per run folder."""
+    def __init__(self):
+        self._status = {}
+        self._lock   = threading.Lock()
+
+    def start(self,path,thresholds,percentiles,max_workers=None):
+        with self._lock:
+            if self._status.get(path) == 'running':
+                return False
+            self._status[path] = 'running'
+        def target():
+            try:
+                compute_ensemble(path,thresholds,percentiles,max_workers=max_workers)
+                status = 'finished'
+            except Exception as e:
+                print(f"Ensemble post-processing failed: {e}")
+                status = f'failed: {e}'
+            with self._lock:
+                self._status[path] = status
+        threading.Thread(target=target,daemon=True).start()
+        return True
+
+    def status(self,path):
+        return self._status.get(path)
+
+ensemble_jobs = EnsembleJobs()
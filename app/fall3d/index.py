@@ -0,0 +1,209 @@
+import os
+import json
+import math
+import threading
+
+PERCENTILES = (50, 90, 99)
+# Global histogram of positive values: 10 log-spaced bins per decade
+HIST_RANGE  = (-10, 10)
+HIST_BINS   = 200
+
+_indexes = {}
+_lock    = threading.Lock()
+
+def index_path(path,fname):
+    return os.path.join(path,'.cache',f'{fname}.index.json')
+
+def _file_id(path,fname):
+    filepath = os.path.join(path,fname)
+    st = os.stat(filepath)
+    return [filepath, st.st_mtime_ns, st.st_size]
+
+def load_index(path,fname):
+    """Return the index of an output if it is up to date, None otherwise."""
+    try:
+        file_id = _file_id(path,fname)
+    except OSError:
+        return None
+    with _lock:
+        index = _indexes.get((path,fname))
+    if index is not None and index['file'] == file_id:
+        return index
+    index = _read_index(path,fname)
+    if index is None or index.get('file') != file_id:
+        return None
+    with _lock:
+        _indexes[(path,fname)] = index
+    return index
+
+def save_index(path,fname,index):
+    fname_index = index_path(path,fname)
+    os.makedirs(os.path.dirname(fname_index), exist_ok=True)
+    tmp = f'{fname_index}.{os.getpid()}.tmp'
+    with open(tmp,'w') as f:
+        json.dump(index,f)
+    os.replace(tmp,fname_index)
+    with _lock:
+        _indexes[(path,fname)] = index
+
+def invalidate_index(path,fname):
+    with _lock:
+        _indexes.pop((path,fname),None)
+    try:
+        os.remove(index_path(path,fname))
+    except OSError:
+        pass
+
+def field_stats(values):
+    """Statistics of a single frame (percentiles over positive values)."""
+    import numpy as np
+    finite = values[np.isfinite(values)]
+    if finite.size == 0:
+        return None
+    positive = finite[finite>0]
+    stats = {'min':  float(finite.min()),
+             'max':  float(finite.max()),
+             'mean': float(finite.mean())}
+    if positive.size > 0:
+        pvalues = np.percentile(positive,PERCENTILES)
+    else:
+        pvalues = [0.0]*len(PERCENTILES)
+    for q,v in zip(PERCENTILES,pvalues):
+        stats[f'p{q}'] = float(v)
+    return stats
+
+def _read_index(path,fname):
+    """Index saved on disk, even if out of date (None if missing)."""
+    try:
+        with open(index_path(path,fname)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _add_stats(f,index,key,times,edges):
+    """Append the statistics of some time steps of a variable to the index."""
+    import numpy as np
+    stats  = index['stats'].setdefault(key,[])
+    hist   = index['histogram'].setdefault(key,{'counts': [0]*HIST_BINS, 'zeros': 0})
+    counts = np.array(hist['counts'], dtype=np.int64)
+    zeros  = hist['zeros']
+    for it in times:
+        # Statistics of 4D variables cover all levels
+        values = np.asarray(f.get_field(key,it,level=None).values)
+        stats.append(field_stats(values))
+        values = values[np.isfinite(values)]
+        zeros += int(np.count_nonzero(values<=0))
+        counts += np.histogram(values[values>0],edges)[0]
+    hist['counts'] = counts.tolist()
+    hist['zeros']  = zeros
+
+def _unchanged(f,previous,key,nt):
+    """Check that the first nt time steps of a variable are those of the
+    previous index: same dimensions and same statistics of the last one
+    (the file may have been rewritten by a new run)."""
+    import numpy as np
+    if key not in previous['stats'] or len(previous['stats'][key]) < nt:
+        return False
+    if list(f.ds[key].dims) != previous['vars'].get(key,{}).get('dims'):
+        return False
+    values = np.asarray(f.get_field(key,nt-1,level=None).values)
+    return field_stats(values) == previous['stats'][key][nt-1]
+
+def build_index(f,previous=None):
+    """Scan an output once and return its index.
+
+    The index holds the metadata needed by the plot form (variables,
+    dimensions, times, units and long names), the statistics of every
+    plottable variable at each time step and a global histogram of
+    positive values. Each time step is read once.
+
+    If a previous index of the same output is given and its times are
+    the first ones of the file (time steps appended by a running model),
+    only the new time steps are read.
+    """
+    import numpy as np
+    ds = f.ds
+    edges = np.logspace(HIST_RANGE[0],HIST_RANGE[1],HIST_BINS+1)
+    index = {'file':  _file_id(f.path,f.fname),
+             'times': [str(t) for t in ds['time'].dt.strftime("%Y-%m-%dT%H:%M:%S").values],
+             'plot':  f.get_vars(),
+             'vars':  {},
+             'levels': {},
+             'stats': {},
+             'histogram': {'edges': [float(e) for e in edges]}}
+    variables = dict(ds.data_vars)
+    if f.derived is not None:
+        variables.update(f.derived.data_vars)
+    for name, v in variables.items():
+        index['vars'][name] = {'dims':      list(v.dims),
+                               'shape':     list(v.shape),
+                               'units':     v.attrs.get('units'),
+                               'long_name': v.attrs.get('long_name')}
+    nt = 0
+    if previous is not None and previous.get('file',[None])[0] == index['file'][0]:
+        old = previous['times']
+        if old == index['times'][:len(old)]:
+            nt = len(old)
+    for key in index['plot']:
+        index['levels'][key] = f.get_level_labels(key)
+        if f.is_derived(key):
+            # Derived variables have a single frame
+            _add_stats(f,index,key,[0],edges)
+            continue
+        if nt > 0 and _unchanged(f,previous,key,nt):
+            index['stats'][key] = previous['stats'][key][:nt]
+            index['histogram'][key] = previous['histogram'][key]
+            _add_stats(f,index,key,f.get_times()[nt:],edges)
+        else:
+            _add_stats(f,index,key,f.get_times(),edges)
+    return index
+
+def get_index(f):
+    """Index of a loaded output, building and saving it if needed.
+
+    A stale index is updated incrementally when time steps have been
+    appended to the output.
+    """
+    index = load_index(f.path,f.fname)
+    if index is None:
+        with _lock:
+            previous = _indexes.get((f.path,f.fname))
+        if previous is None:
+            previous = _read_index(f.path,f.fname)
+        index = build_index(f,previous)
+        save_index(f.path,f.fname,index)
+    return index
+
+def nice_number(x):
+    """Round up to 1, 2 or 5 times a power of ten."""
+    if x <= 0:
+        return 1.0
+    exp = math.floor(math.log10(x))
+    for m in (1,2,5,10):
+        if m*10**exp >= x:
+            return m*10**exp
+
+def suggest_levels(index,key,q=99.0,nlevels=10):
+    """Contour levels shared by all frames: (minval,maxval,step).
+
+    The upper bound is the q-th percentile of the positive values over
+    the whole run, taken from the global histogram.
+    """
+    hist = index['histogram'].get(key)
+    if hist is None:
+        return None
+    counts = hist['counts']
+    edges  = index['histogram']['edges']
+    total  = sum(counts)
+    if total == 0:
+        return (0.0, 1.0, 0.1)
+    target = q/100*total
+    acc = 0
+    vmax = edges[-1]
+    for i,c in enumerate(counts):
+        acc += c
+        if acc >= target:
+            vmax = edges[i+1]
+            break
+    step = nice_number(vmax/nlevels)
+    return (0.0, step*nlevels, step)
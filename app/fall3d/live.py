@@ -0,0 +1,93 @@
+import os
+import time
+import queue
+import threading
+
+class LiveWatcher:
+    """Watch outputs of running models and notify new time steps.
+
+    One thread per watched output polls the file status every `interval`
+    seconds while there are subscribers. When the file changes, the
+    dataset is reopened (only coordinates are read in lazy mode) and the
+    index is updated with the new time steps only. Subscribers receive
+    {'nt': number of time steps, 'times': new times} in their queue.
+    """
+    def __init__(self,interval=2.0):
+        self.interval = interval
+        self._watched = {}
+        self._lock    = threading.Lock()
+
+    def init_app(self,app):
+        self.interval = app.config.get('LIVE_POLL_INTERVAL', self.interval)
+
+    def subscribe(self,path,fname,extent=None):
+        """Queue receiving the events of an output (starts with the current state)."""
+        q = queue.Queue(maxsize=100)
+        index = (path,fname)
+        with self._lock:
+            watch = self._watched.get(index)
+            if watch is None:
+                watch = self._watched[index] = {'queues': set(), 'nt': None}
+                threading.Thread(target=self._watch,
+                                 args=(path,fname,extent),
+                                 daemon=True).start()
+            watch['queues'].add(q)
+            if watch['nt'] is not None:
+                q.put({'nt': watch['nt'], 'times': []})
+        return q
+
+    def unsubscribe(self,path,fname,q):
+        with self._lock:
+            watch = self._watched.get((path,fname))
+            if watch is not None:
+                watch['queues'].discard(q)
+
+    def _publish(self,watch,event):
+        for q in list(watch['queues']):
+            try:
+                q.put_nowait(event)
+            except queue.Full:
+                # Slow client: it will catch up with the next event
+                pass
+
+    def _update(self,path,fname,extent):
+        """Number of time steps and their labels, from the (updated) index."""
+        from app.extensions import datasets
+        from app.fall3d.index import get_index
+        f = datasets.get(path,fname,extent)
+        if f is None:
+            return None
+        return get_index(f)['times']
+
+    def _watch(self,path,fname,extent):
+        index = (path,fname)
+        filepath = os.path.join(path,fname)
+        stamp = None
+        while True:
+            with self._lock:
+                watch = self._watched[index]
+                if not watch['queues'] and watch['nt'] is not None:
+                    del self._watched[index]
+                    return
+            try:
+                st = os.stat(filepath)
+                current = (st.st_ino, st.st_mtime_ns, st.st_size)
+            except OSError:
+                current = None
+            if current is not None and current != stamp:
+                try:
+                    times = self._update(path,fname,extent)
+                except Exception as e:
+                    # The file may be in the middle of a write: retry later
+                    print(f"Live update of {filepath} failed: {e}")
+                    times = None
+                if times is not None:
+                    stamp = current
+                    nt = watch['nt'] or 0
+                    if watch['nt'] is None or len(times) != nt:
+                        new = times[nt:] if len(times) > nt else []
+                        watch['nt'] = len(times)
+                        self._publish(watch,{'nt': len(times), 'times': new})
+            if watch['nt'] is None:
+                watch['nt'] = 0
+            time.sleep(self.interval)
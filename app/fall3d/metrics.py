@@ -0,0 +1,129 @@
+import json
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+logger = logging.getLogger('app.render')
+
+# Upper bounds (seconds) of the histogram buckets
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float('inf'))
+QUANTILES = (50, 90, 99)
+
+class Timer:
+    """Accumulated wall time of the phases of an operation."""
+    def __init__(self):
+        self.phases = {}
+
+    @contextmanager
+    def phase(self,name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name,0.0) + time.perf_counter()-t0
+
+    @property
+    def total(self):
+        return sum(self.phases.values())
+
+def _quantile(values,q):
+    values = sorted(values)
+    return values[min(len(values)-1, int(q/100*len(values)))]
+
+class RenderMetrics:
+    """Rolling statistics of the last renders.
+
+    Each render records the duration of its phases (open, read, basemap,
+    features, contour, colorbar, savefig), the bytes read from the output
+    and the size of the image. Only the last `window` renders are kept.
+    """
+    def __init__(self,window=1000):
+        self.window  = window
+        self.renders = 0
+        self.cache   = {'hit': 0, 'miss': 0}
+        self._phases = {}
+        self._bytes  = deque(maxlen=window)
+        self._sizes  = deque(maxlen=window)
+        self._lock   = threading.Lock()
+
+    def init_app(self,app):
+        self.window = app.config.get('METRICS_WINDOW', self.window)
+        self._bytes = deque(maxlen=self.window)
+        self._sizes = deque(maxlen=self.window)
+        # Renders are recorded outside of the app context, so the render
+        # logger is configured here rather than through app.logger
+        logger.setLevel(app.config.get('RENDER_LOG_LEVEL','INFO'))
+        if not logger.handlers:
+            handler = logging.StreamHandler()
+            handler.setFormatter(logging.Formatter('%(asctime)s %(name)s %(message)s'))
+            logger.addHandler(handler)
+            logger.propagate = False
+
+    def cache_hit(self,hit):
+        with self._lock:
+            self.cache['hit' if hit else 'miss'] += 1
+
+    def record(self,phases,bytes_read,size,**tags):
+        """Add a render and write a structured log line."""
+        phases = dict(phases)
+        phases['total'] = sum(phases.values())
+        with self._lock:
+            self.renders += 1
+            for name, seconds in phases.items():
+                if name not in self._phases:
+                    self._phases[name] = deque(maxlen=self.window)
+                self._phases[name].append(seconds)
+            self._bytes.append(bytes_read)
+            self._sizes.append(size)
+        logger.info(json.dumps({'event':      'render',
+                                **tags,
+                                'phases':     {k: round(v,6) for k,v in phases.items()},
+                                'bytes_read': bytes_read,
+                                'size':       size}))
+
+    def summary(self):
+        """Count, mean, quantiles and histogram of every phase (JSON)."""
+        with self._lock:
+            phases = {name: list(values) for name, values in self._phases.items()}
+            nbytes = list(self._bytes)
+            sizes  = list(self._sizes)
+        out = {'renders': self.renders,
+               'window':  self.window,
+               'cache':   dict(self.cache),
+               'buckets': [str(b) for b in BUCKETS],
+               'phases':  {}}
+        for name, values in phases.items():
+            stats = {'count': len(values),
+                     'mean':  sum(values)/len(values),
+                     'max':   max(values)}
+            for q in QUANTILES:
+                stats[f'p{q}'] = _quantile(values,q)
+            stats['histogram'] = [sum(1 for v in values if v <= b) for b in BUCKETS]
+            out['phases'][name] = stats
+        for name, values in (('bytes_read',nbytes),('size',sizes)):
+            if values:
+                out[name] = {'mean': sum(values)/len(values),
+                             'max':  max(values)}
+        return out
+
+    def to_text(self):
+        """Plain text exposition (one metric per line, Prometheus style)."""
+        summary = self.summary()
+        lines = [f"render_total {summary['renders']}"]
+        for k, v in summary['cache'].items():
+            lines.append(f'render_cache_total{{result="{k}"}} {v}')
+        for name, stats in summary['phases'].items():
+            for q in QUANTILES:
+                lines.append(f'render_phase_seconds{{phase="{name}",quantile="0.{q}"}} {stats[f"p{q}"]:.6f}')
+            for b, n in zip(summary['buckets'],stats['histogram']):
+                le = '+Inf' if b == 'inf' else b
+                lines.append(f'render_phase_seconds_bucket{{phase="{name}",le="{le}"}} {n}')
+            lines.append(f'render_phase_seconds_count{{phase="{name}"}} {stats["count"]}')
+            lines.append(f'render_phase_seconds_sum{{phase="{name}"}} {stats["mean"]*stats["count"]:.6f}')
+        for name in ('bytes_read','size'):
+            if name in summary:
+                lines.append(f'render_{name}_bytes_mean {summary[name]["mean"]:.0f}')
+                lines.append(f'render_{name}_bytes_max {summary[name]["max"]}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,32 @@
+import struct
+import zlib
+
+SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+def chunk(tag,data):
+    """Serialize a PNG chunk."""
+    crc = zlib.crc32(tag+data) & 0xffffffff
+    return struct.pack('>I',len(data)) + tag + data + struct.pack('>I',crc)
+
+def read_chunks(png):
+    """Iterate over the (tag,data) chunks of a PNG byte string."""
+    pos = len(SIGNATURE)
+    while pos < len(png):
+        (length,) = struct.unpack('>I',png[pos:pos+4])
+        tag  = png[pos+4:pos+8]
+        data = png[pos+8:pos+8+length]
+        pos += length + 12
+        yield tag, data
+
+def encode_png(rgba,level=6):
+    """Encode an RGBA uint8 array with shape (height,width,4) as PNG."""
+    import numpy as np
+    height, width, _ = rgba.shape
+    # Each scanline starts with the filter type byte (0: None)
+    raw = np.zeros((height,4*width+1), dtype=np.uint8)
+    raw[:,1:] = rgba.reshape(height,-1)
+    ihdr = struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)
+    return b''.join([SIGNATURE,
+                     chunk(b'IHDR', ihdr),
+                     chunk(b'IDAT', zlib.compress(raw.tobytes(),level)),
+                     chunk(b'IEND', b'')])
@@ -1,18 +1,45 @@
 import numpy as np
 import xarray as xr
-import matplotlib
-import matplotlib.pyplot as plt
-from matplotlib.colors import BoundaryNorm
-import cartopy.crs as crs
-import cartopy.feature as cfeature
+from app.fall3d.basemap import get_basemap
+from app.fall3d.derived import open_derived, derived_path
+from app.fall3d.metrics import Timer
 import os
 import io
+import copy
+
+def interp_weights(axis,values):
+    """Lower index and weight of linear interpolation on a 1D axis.
+
+    Returns (index, weight, inside) where inside flags the values within
+    the axis range.
+    """
+    n = len(axis)
+    if axis[0] > axis[-1]:
+        pos = (n-1) - np.interp(values, axis[::-1], np.arange(n))
+    else:
+        pos = np.interp(values, axis, np.arange(n))
+    inside = (values >= min(axis[0],axis[-1])) & (values <= max(axis[0],axis[-1]))
+    index = np.clip(np.floor(pos).astype(int), 0, max(n-2,0))
+    weight = pos - index
+    return index, weight, inside
 
 class Fall3D:
-    def __init__(self,path,fname):
-        self.path  = path
-        self.fname = fname
-        self.ds    = None
+    def __init__(self,path,fname,extent=None,lazy=False,float32=False):
+        self.path    = path
+        self.fname   = fname
+        self.ds      = None
+        self.derived = None
+        self.extent  = extent
+        self.lazy    = lazy
+        self.float32 = float32
+
+        # Bytes read from the file by get_field
+        self.bytes_read = 0
+        # Duration of the load and plot phases
+        self.timer = Timer()
+        # Live views identify the file by its generation (see file_id)
+        self.live       = False
+        self.generation = 0
 
         # Properties
         self._key      = "tephra_col_mass"
@@ -21,6 +48,7 @@ class Fall3D:
         self._step     = 0.1
         self._log      = False
         self._auto     = False
+        self._level    = 0
 
     @property
     def key(self):
@@ -70,6 +98,82 @@ class Fall3D:
     def auto(self,value):
         self._auto = value
 
+    @property
+    def level(self):
+        return self._level
+
+    @level.setter
+    def level(self,value):
+        self._level = value
+
+    @property
+    def filepath(self):
+        return os.path.join(self.path,self.fname)
+
+    @property
+    def settings(self):
+        """Render settings that determine the output image."""
+        return (self.key, self.minval, self.maxval, self.step, self.log, self.auto, self.level)
+
+    @settings.setter
+    def settings(self,value):
+        (self.key, self.minval, self.maxval, self.step, self.log, self.auto, self.level) = value
+
+    @property
+    def spec(self):
+        """Arguments needed to open the same output in another process."""
+        return {'path':    self.path,
+                'fname':   self.fname,
+                'extent':  self.extent,
+                'lazy':    self.lazy,
+                'float32': self.float32}
+
+    def with_settings(self,settings=None):
+        """Shallow copy sharing the dataset, with its own render settings."""
+        view = copy.copy(self)
+        if settings is not None:
+            view.settings = tuple(settings)
+        view.bytes_read = 0
+        view.timer = Timer()
+        return view
+
+    @property
+    def nbytes(self):
+        """Memory held by the dataset (only coordinates in lazy mode)."""
+        if self.ds is None:
+            return 0
+        if self.lazy:
+            return sum(c.nbytes for c in self.ds.coords.values())
+        return self.ds.nbytes
+
+    def close(self):
+        """Close the files; the datasets are kept since views or running
+        requests may still use them (xarray reopens the file if needed)."""
+        if self.ds is not None:
+            self.ds.close()
+        if self.derived is not None:
+            self.derived.close()
+
+    def file_id(self):
+        """Identity of the output file: (path, mtime, size[, derived mtime]).
+
+        In live mode, the identity doesn't change when time steps are
+        appended, so cached frames of the previous time steps are kept
+        while the model is running: (path, 'live', inode, generation).
+        """
+        st = os.stat(self.filepath)
+        if self.live:
+            file_id = (self.filepath, 'live', st.st_ino, self.generation)
+        else:
+            file_id = (self.filepath, st.st_mtime_ns, st.st_size)
+        if self.derived is not None:
+            file_id += (os.stat(derived_path(self.path,self.fname)).st_mtime_ns,)
+        return file_id
+
+    def cacheable(self,it):
+        """False for the newest time step of a live output, which may still be written."""
+        return not (self.live and it == self.ds.sizes['time']-1)
+
     def load(self):
         """Open an xarray dataset from a file, returning False if the file doesn't exist."""
         ###
@@ -78,110 +182,215 @@ class Fall3D:
         if not self.ds is None:
             return True
 
-        filepath = os.path.join(self.path,self.fname)
+        filepath = self.filepath
         if not os.path.isfile(filepath):
             # If the file doesn't exist, return False
             return False
         
-        try:
-            # Try to open the dataset
-            self.ds = xr.open_dataset(filepath)
-            return True
-        except FileNotFoundError:
-            # Return False if file not found or any issue occurs
-            return False
-        except Exception as e:
-            # Handle any other exceptions that might occur
-            print(f"An error occurred: {e}")
-            return False
+        with self.timer.phase('open'):
+            try:
+                # Try to open the dataset
+                if self.lazy:
+                    # Time-aligned chunks (if dask is available) and no
+                    # in-memory caching: only the requested slices are read
+                    try:
+                        import dask
+                        chunks = {'time': 1}
+                    except ImportError:
+                        chunks = None
+                    self.ds = xr.open_dataset(filepath, chunks=chunks, cache=False)
+                else:
+                    self.ds = xr.open_dataset(filepath)
+                self.derived = open_derived(self.path,self.fname)
+                return True
+            except FileNotFoundError:
+                # Return False if file not found or any issue occurs
+                return False
+            except Exception as e:
+                # Handle any other exceptions that might occur
+                print(f"An error occurred: {e}")
+                return False
 
     def get_times(self):
         nt = self.ds.sizes['time']
         return [it for it in range(nt)]
 
-    def get_vars(self):
-        dims = ('time','lat','lon')
-        vars = [s for s,v in self.ds.data_vars.items() if dims==v.dims]
+    def get_extent(self):
+        """Domain (LONMIN,LONMAX,LATMIN,LATMAX), from the GRID block if given."""
+        if self.extent is not None:
+            return self.extent
+        ds = self.ds
+        return (float(ds.lon.min()), float(ds.lon.max()),
+                float(ds.lat.min()), float(ds.lat.max()))
+
+    def get_vars(self,derived=True,levels=True):
+        """Plottable variables: (time,lat,lon), (time,level,lat,lon) if levels
+        and the derived variables if derived."""
+        vars = []
+        for s,v in self.ds.data_vars.items():
+            if v.dims == ('time','lat','lon'):
+                vars.append(s)
+            elif levels and len(v.dims)==4 and v.dims[0]=='time' and v.dims[2:]==('lat','lon'):
+                vars.append(s)
+        if derived and self.derived is not None:
+            vars += list(self.derived.data_vars)
         return vars
 
+    def get_level_dim(self,key):
+        """Level dimension (flight level, height, bin...) of a 4D variable or None."""
+        if self.is_derived(key):
+            return None
+        dims = self.ds[key].dims
+        return dims[1] if len(dims) == 4 else None
+
+    def get_level_labels(self,key):
+        """Labels of the levels of a variable (empty for 2D fields)."""
+        dim = self.get_level_dim(key)
+        if dim is None:
+            return []
+        if dim not in self.ds.coords:
+            return [f"{dim} {i}" for i in range(self.ds.sizes[dim])]
+        coord = self.ds[dim]
+        units = coord.attrs.get('units','')
+        return [f"{dim} {v:g} {units}".strip() for v in coord.values]
+
+    def is_derived(self,key):
+        return key not in self.ds.data_vars and self.derived is not None and key in self.derived.data_vars
+
+    def get_data(self,key,it,level=-1):
+        """Lazy (lat,lon) array of a variable at a time step.
+
+        Derived variables have no time dimension and ignore it. For 4D
+        variables, only the selected level is read (level=None keeps all
+        of them, the default is the level setting).
+        """
+        if self.is_derived(key):
+            return self.derived[key]
+        da = self.ds[key].isel(time=it)
+        dim = self.get_level_dim(key)
+        if dim is not None and level is not None:
+            da = da.isel({dim: self.level if level == -1 else level})
+        return da
+
+    def get_field(self,key,it,level=-1):
+        """Load a single time step of a variable."""
+        with self.timer.phase('read'):
+            da = self.get_data(key,it,level).load()
+        self.bytes_read += da.nbytes
+        if self.float32 and da.dtype == np.float64:
+            da = da.astype(np.float32)
+        return da
+
+    def get_series(self,key,lons,lats):
+        """Time series of a variable at points, using bilinear interpolation.
+
+        The weights are computed once for all points and applied to every
+        time step at once. Points outside the grid give NaN. Returns an
+        array with shape (npoints,ntimes).
+        """
+        lons = np.atleast_1d(np.asarray(lons,dtype=float))
+        lats = np.atleast_1d(np.asarray(lats,dtype=float))
+        i0, wx, okx = interp_weights(self.ds.lon.values,lons)
+        j0, wy, oky = interp_weights(self.ds.lat.values,lats)
+        # Corners of the cell containing each point: (npoints,4)
+        jj = np.stack([j0, j0, j0+1, j0+1], axis=-1)
+        ii = np.stack([i0, i0+1, i0, i0+1], axis=-1)
+        ww = np.stack([(1-wy)*(1-wx), (1-wy)*wx, wy*(1-wx), wy*wx], axis=-1)
+        # Read only the rows and columns needed: (time,nrows,ncols)
+        rows, jj = np.unique(jj, return_inverse=True)
+        cols, ii = np.unique(ii, return_inverse=True)
+        da = self.ds[key]
+        dim = self.get_level_dim(key)
+        if dim is not None:
+            da = da.isel({dim: self.level})
+        block = da.isel(lat=rows,lon=cols).values
+        self.bytes_read += block.nbytes
+        values = block[:,jj.reshape(ww.shape),ii.reshape(ww.shape)]
+        series = np.einsum('tpk,pk->pt',values,ww)
+        series[~(okx & oky)] = np.nan
+        return series
+
+    def get_levels(self):
+        """Contour levels from the user settings (None for automatic levels)."""
+        if self.auto:
+            return None
+        levels = np.arange(0.0,self.maxval+self.step,self.step)
+        if self.minval > 0:
+            levels = [l for l in levels if l>self.minval]
+            levels.insert(0,self.minval)
+        return list(levels)
+
     def plot(self,it):
+        """Render a frame as PNG (BytesIO).
+
+        The duration of each phase is accumulated in self.timer. Note that
+        matplotlib draws the artists in savefig, so the other phases only
+        measure their setup.
+        """
+        # The plotting stack is only needed by the render workers
+        import matplotlib
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.colors import BoundaryNorm
+        import cartopy.crs as crs
         key = self.key
+        timer = self.timer
         ###
         ### Generate map
         ###
-        proj = crs.PlateCarree()
-        fig, ax = plt.subplots( subplot_kw={'projection': proj} )
+        with timer.phase('basemap'):
+            basemap = get_basemap(self.get_extent())
+            # Object-oriented Agg API: no pyplot global state, and the figure
+            # is released as soon as the function returns
+            fig = Figure()
+            FigureCanvasAgg(fig)
+            ax = fig.add_subplot(projection=basemap.proj)
         ###
-        ### Add map features
+        ### Add cached map features and grid lines
         ###
-        BORDERS = cfeature.NaturalEarthFeature(
-                scale     = '10m',
-                category  = 'cultural',
-                name      = 'admin_0_countries',
-                edgecolor = 'gray',
-                facecolor = 'none'
-                )
-        LAND = cfeature.NaturalEarthFeature(
-                'physical', 'land', '10m',
-                edgecolor = 'none',
-                facecolor = 'lightgrey',
-                alpha     = 0.8
-                )
-        
-        ax.add_feature(LAND,zorder=0)
-        ax.add_feature(BORDERS, linewidth=0.4)
-        ###
-        ### Add grid lines
-        ###
-        gl = ax.gridlines(
-            crs         = crs.PlateCarree(),
-            draw_labels = True,
-            linewidth   = 0.5,
-            color       = 'gray',
-            alpha       = 0.5,
-            linestyle   = '--')
-        gl.top_labels    = False
-        gl.right_labels  = False
-        gl.xlabel_style  = {'fontsize': 7}
-        gl.ylabel_style  = {'fontsize': 7,
-                            'rotation': 90}
+        with timer.phase('features'):
+            basemap.draw(ax)
         ###
         ### Plot contours
         ###
         ds = self.ds
-        cmap = plt.cm.RdYlBu_r
-        time_fmt = ds.isel(time=it)['time'].dt.strftime("%d/%m/%Y %H:%M").item()
-        ax.set_title(time_fmt, loc='right')
+        field = self.get_field(key,it)
+        with timer.phase('contour'):
+            cmap = matplotlib.colormaps['RdYlBu_r']
+            if self.is_derived(key):
+                # Summaries over the whole run
+                times = ds['time'].dt.strftime("%d/%m/%Y %H:%M").values
+                time_fmt = f"{times[0]} - {times[-1]}"
+            else:
+                time_fmt = ds.isel(time=it)['time'].dt.strftime("%d/%m/%Y %H:%M").item()
+            ax.set_title(time_fmt, loc='right')
+            if self.get_level_dim(key) is not None:
+                ax.set_title(self.get_level_labels(key)[self.level], loc='left')
 
-        if self.auto:
-            fc = ax.contourf(
-                ds.lon,ds.lat,ds.isel(time=it)[key],
-                cmap      = cmap,
-                transform = crs.PlateCarree())
-        else:
-            levels = np.arange(0.0,self.maxval+self.step,self.step)
-            print('0:',self.maxval)
-            print('1:',levels)
-            if self.minval > 0:
-                levels = [l for l in levels if l>self.minval]
-                levels.insert(0,self.minval)
-            print('2:',levels)
-            fc = ax.contourf(
-                ds.lon,ds.lat,ds.isel(time=it)[key],
-                levels    = levels,
-                norm      = BoundaryNorm(levels,cmap.N),
-                cmap      = cmap,
-                extend    = 'max',
-                transform = crs.PlateCarree())
+            levels = self.get_levels()
+            if levels is None:
+                fc = ax.contourf(
+                    ds.lon,ds.lat,field,
+                    cmap      = cmap,
+                    transform = crs.PlateCarree())
+            else:
+                fc = ax.contourf(
+                    ds.lon,ds.lat,field,
+                    levels    = levels,
+                    norm      = BoundaryNorm(levels,cmap.N),
+                    cmap      = cmap,
+                    extend    = 'max',
+                    transform = crs.PlateCarree())
     
         ###
         ### Generate colorbar
         ###
-        label = ds[key].long_name
-        cbar=fig.colorbar(fc,
-            orientation = 'vertical',
-            label       = label,
-            )
+        with timer.phase('colorbar'):
+            label = field.attrs.get('long_name',key)
+            cbar=fig.colorbar(fc,
+                orientation = 'vertical',
+                label       = label,
+                )
     
         ###
         ### Output plot
@@ -191,9 +400,10 @@ class Fall3D:
         #plt.savefig(filepath,dpi=300,bbox_inches='tight')
 
         # Save the figure to a bytes buffer
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png')
-        buf.seek(0)
+        with timer.phase('savefig'):
+            buf = io.BytesIO()
+            fig.savefig(buf, format='png')
+            buf.seek(0)
 
         return buf
 
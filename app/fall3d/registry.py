@@ -0,0 +1,103 @@
+import os
+import threading
+from collections import OrderedDict
+
+class DatasetRegistry:
+    """Thread-safe LRU registry of open FALL3D outputs.
+
+    Datasets are keyed by run folder and file name. A dataset is reopened
+    when its file changes on disk, and the least recently used ones are
+    closed when the number of open files or their (uncompressed) size
+    exceeds the limits. Evicted datasets are closed at once, so the number
+    of open files stays within the limit (xarray reopens the file if a
+    running request still uses it).
+
+    Outputs that only grow (time steps appended by a running model) keep
+    their generation number, so that live views can keep the frames of
+    the previous time steps; see Fall3D.file_id.
+
+    Objects returned by get() are shared between requests, so render
+    settings must not be set on them: use Fall3D.with_settings() to get
+    a per-request view.
+    """
+    def __init__(self,max_open=16,max_memory=4*2**30,lazy=False,float32=False):
+        self.max_open   = max_open
+        self.max_memory = max_memory
+        self.lazy       = lazy
+        self.float32    = float32
+        self._items     = OrderedDict()
+        self._lock      = threading.RLock()
+
+    def init_app(self,app):
+        self.max_open   = app.config.get('DATASETS_MAX_OPEN',   self.max_open)
+        self.max_memory = app.config.get('DATASETS_MAX_MEMORY', self.max_memory)
+        self.lazy       = app.config.get('DATASETS_LAZY',       self.lazy)
+        self.float32    = app.config.get('DATASETS_FLOAT32',    self.float32)
+
+    def get(self,path,fname,extent=None):
+        """Return the loaded Fall3D object or None if the file cannot be read."""
+        from app.fall3d.post import Fall3D
+        index = (path,fname)
+        try:
+            st = os.stat(os.path.join(path,fname))
+        except OSError:
+            self.close(path,fname)
+            return None
+        file_id = (os.path.join(path,fname), st.st_mtime_ns, st.st_size)
+        old = None
+        with self._lock:
+            generation = 0
+            item = self._items.get(index)
+            if item is not None:
+                (f, opened_id, inode) = item
+                if opened_id == file_id and f.extent == extent:
+                    self._items.move_to_end(index)
+                    return f
+                # The output file has changed since it was opened:
+                # same file if it was only appended to
+                generation = f.generation
+                if inode != st.st_ino or st.st_size < opened_id[2]:
+                    generation += 1
+                del self._items[index]
+                old = f
+        if old is not None:
+            # HDF5 shares the handles of a file opened twice in a
+            # process, so the old one must be closed to see the new
+            # records (xarray reopens it if a request still uses it)
+            old.close()
+        # Opened without the lock, so other files are not kept waiting
+        f = Fall3D(path,fname,extent,lazy=self.lazy,float32=self.float32)
+        f.generation = generation
+        if not f.load():
+            return None
+        with self._lock:
+            item = self._items.get(index)
+            if item is not None and item[1] == file_id and item[0].extent == extent:
+                # Opened by another request in the meantime
+                f.close()
+                return item[0]
+            if item is not None:
+                item[0].close()
+            self._items[index] = (f,file_id,st.st_ino)
+            self._items.move_to_end(index)
+            evicted = self._evict()
+        for item in evicted:
+            item[0].close()
+        return f
+
+    def close(self,path,fname):
+        with self._lock:
+            item = self._items.pop((path,fname),None)
+        if item is not None:
+            item[0].close()
+
+    def _evict(self):
+        """Drop least recently used datasets above the limits (keeps the newest)
+        and return them, to be closed outside the lock."""
+        evicted = []
+        while len(self._items) > 1:
+            memory = sum(item[0].nbytes for item in self._items.values())
+            if len(self._items) <= self.max_open and memory <= self.max_memory:
+                break
+            evicted.append(self._items.popitem(last=False)[1])
+        return evicted
@@ -0,0 +1,81 @@
+import json
+import struct
+import zlib
+
+MAGIC  = b'F3DS'
+NODATA = 65535
+CHUNK  = 2**20
+
+def _view(array):
+    """Raw little-endian bytes of an array without copying when possible."""
+    import numpy as np
+    array = np.ascontiguousarray(array)
+    if array.dtype.byteorder == '>':
+        array = array.byteswap().view(array.dtype.newbyteorder('<'))
+    return memoryview(array).cast('B')
+
+def quantize(values):
+    """Quantize a float field to uint16 (NaN -> NODATA); return (q,scale,offset)."""
+    import numpy as np
+    finite = np.isfinite(values)
+    if finite.any():
+        vmin = float(values[finite].min())
+        vmax = float(values[finite].max())
+    else:
+        vmin = vmax = 0.0
+    scale = (vmax-vmin)/(NODATA-1) if vmax > vmin else 1.0
+    tmp = np.subtract(values, vmin, dtype=np.float32)
+    tmp /= scale
+    np.rint(tmp, out=tmp)
+    tmp[~finite] = NODATA
+    return tmp.astype('<u2'), scale, vmin
+
+def encode_slice(da,dtype='float32',compress=False,meta=None):
+    """Serialize a 2D (lat,lon) DataArray as a compact binary payload.
+
+    Layout:
+        b'F3DS' | uint32 header length | JSON header | lon | lat | data
+
+    lon and lat are float32 and data is float32 or uint16 (value =
+    offset + scale*q, NODATA for missing values), all little-endian.
+    When compress is set, everything after the header is a zlib stream.
+    The function yields byte chunks so it can be used for a streamed
+    response, and the field is never copied as a whole.
+    """
+    import numpy as np
+    values = np.asarray(da.values)
+    if dtype == 'uint16':
+        data, scale, offset = quantize(values)
+    elif dtype == 'float32':
+        data, scale, offset = values.astype('<f4', copy=False), 1.0, 0.0
+    else:
+        raise ValueError(f"Unsupported dtype: {dtype}")
+    lon = da.lon.values.astype('<f4', copy=False)
+    lat = da.lat.values.astype('<f4', copy=False)
+
+    header = dict(meta or {})
+    header.update({
+        'dtype':       dtype,
+        'shape':       list(data.shape),
+        'scale':       scale,
+        'offset':      offset,
+        'nodata':      NODATA if dtype == 'uint16' else None,
+        'compression': 'zlib' if compress else None,
+        'units':       da.attrs.get('units'),
+        'long_name':   da.attrs.get('long_name'),
+        })
+    header = json.dumps(header).encode()
+    yield MAGIC + struct.pack('<I',len(header)) + header
+
+    compressor = zlib.compressobj(6) if compress else None
+    for array in (lon,lat,data):
+        buf = _view(array)
+        # WSGI servers require bytes: copy at most one chunk at a time
+        for i in range(0,len(buf),CHUNK):
+            if compressor is None:
+                yield bytes(buf[i:i+CHUNK])
+            else:
+                out = compressor.compress(buf[i:i+CHUNK])
+                if out: yield out
+    if compressor is not None:
+        yield compressor.flush()
@@ -0,0 +1,110 @@
+import math
+import threading
+from collections import OrderedDict
+from app.fall3d.png import encode_png
+
+TILE_SIZE = 256
+
+def pixel_centers(z,x,y,size=TILE_SIZE):
+    """Longitudes and latitudes of the pixel centres of a web-mercator tile."""
+    import numpy as np
+    n  = 2**z
+    px = (x + (np.arange(size)+0.5)/size)/n
+    py = (y + (np.arange(size)+0.5)/size)/n
+    lon = 360.0*px - 180.0
+    lat = np.degrees(np.arctan(np.sinh(math.pi*(1.0-2.0*py))))
+    return lon, lat
+
+def nearest_index(axis,values):
+    """Nearest index on a regular axis for each value (-1 outside the grid)."""
+    import numpy as np
+    n = len(axis)
+    if n < 2:
+        idx = np.zeros(len(values), dtype=int)
+    else:
+        d   = (axis[-1]-axis[0])/(n-1)
+        idx = np.rint((values-axis[0])/d).astype(int)
+    idx[(idx<0) | (idx>=n)] = -1
+    return idx
+
+def get_lut(nlevels,cmap='RdYlBu_r'):
+    """RGBA lookup table with one colour per contour band plus the 'max' extension."""
+    import numpy as np
+    from matplotlib import colormaps
+    cmap = colormaps[cmap]
+    idx  = np.rint(np.linspace(0,cmap.N-1,nlevels)).astype(int)
+    return (255*cmap(idx)).astype(np.uint8)
+
+def auto_levels(vmin,vmax,nbins=8):
+    """Levels chosen as contourf would do with automatic levels."""
+    from matplotlib.ticker import MaxNLocator
+    return list(MaxNLocator(nbins+1).tick_values(vmin,vmax))
+
+def colorize(values,levels,lut):
+    """Map a field to RGBA using discrete levels; below range or NaN is transparent."""
+    import numpy as np
+    k = np.digitize(values,levels) - 1
+    valid = (k>=0) & np.isfinite(values)
+    rgba = lut[np.clip(k,0,len(lut)-1)]
+    rgba[~valid] = 0
+    return rgba
+
+_empty = None
+
+def empty_tile():
+    global _empty
+    if _empty is None:
+        import numpy as np
+        _empty = encode_png(np.zeros((TILE_SIZE,TILE_SIZE,4), dtype=np.uint8))
+    return _empty
+
+def render_tile(da,levels,z,x,y,cmap='RdYlBu_r'):
+    """Render a tile from a 2D (lat,lon) DataArray.
+
+    Only the block of the grid covered by the tile is read from the
+    dataset, and pixels are sampled by nearest neighbour.
+    """
+    import numpy as np
+    lon, lat = pixel_centers(z,x,y)
+    ii = nearest_index(da.lon.values,lon)
+    jj = nearest_index(da.lat.values,lat)
+    inside_i = ii>=0
+    inside_j = jj>=0
+    if not inside_i.any() or not inside_j.any():
+        return empty_tile()
+    i0, i1 = ii[inside_i].min(), ii[inside_i].max()
+    j0, j1 = jj[inside_j].min(), jj[inside_j].max()
+    block = np.asarray(da.isel(lat=slice(j0,j1+1), lon=slice(i0,i1+1)).values)
+    rows = np.where(inside_j, jj-j0, 0)
+    cols = np.where(inside_i, ii-i0, 0)
+    values = block[np.ix_(rows,cols)]
+    rgba = colorize(values,levels,get_lut(len(levels),cmap))
+    rgba[~(inside_j[:,None] & inside_i[None,:])] = 0
+    return encode_png(rgba)
+
+class TileCache:
+    """In-memory LRU of encoded tiles, with a separate budget for each zoom level.
+
+    Besides zoom levels, any hashable namespace can be used (e.g. to keep
+    the automatic levels of a frame).
+    """
+    def __init__(self,max_tiles=1024):
+        self.max_tiles = max_tiles
+        self._zooms    = {}
+        self._lock     = threading.Lock()
+
+    def get(self,z,key):
+        with self._lock:
+            tiles = self._zooms.get(z)
+            if tiles is None or key not in tiles:
+                return None
+            tiles.move_to_end(key)
+            return tiles[key]
+
+    def put(self,z,key,data):
+        with self._lock:
+            tiles = self._zooms.setdefault(z,OrderedDict())
+            tiles[key] = data
+            tiles.move_to_end(key)
+            while len(tiles) > self.max_tiles:
+                tiles.popitem(last=False)
@@ -0,0 +1,186 @@
+import os
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future
+from multiprocessing.connection import wait
+
+# Imported by the fork server, so that workers start with the plotting
+# stack loaded but without the state (open files, threads) of the server
+PRELOAD = ['matplotlib.figure', 'matplotlib.backends.backend_agg',
+           'cartopy.crs', 'app.fall3d.post']
+
+def preload():
+    """Import the plotting stack once per worker process."""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.figure
+    import cartopy.crs
+    import app.fall3d.post
+
+def get_rss():
+    """Resident memory of the current process in bytes."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        # Peak memory (KiB on Linux) where /proc is not available
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def _worker(conn,max_tasks,max_rss):
+    """Run tasks received from the pool until asked to stop or recycled."""
+    preload()
+    ntasks = 0
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        (fn, args) = task
+        try:
+            result = ('ok', fn(*args))
+        except Exception as e:
+            result = ('error', e)
+        ntasks += 1
+        recycle = ntasks >= max_tasks or get_rss() > max_rss
+        try:
+            conn.send(result + (recycle,))
+        except Exception as e:
+            # Unpicklable result or exception
+            conn.send(('error', RuntimeError(repr(e)), recycle))
+        if recycle:
+            break
+    conn.close()
+
+class Worker:
+    def __init__(self,ctx,max_tasks,max_rss):
+        self.conn, child = ctx.Pipe()
+        self.process = ctx.Process(target=_worker,
+                                   args=(child,max_tasks,max_rss),
+                                   daemon=True)
+        self.process.start()
+        child.close()
+        self.future = None
+
+class RenderPool:
+    """Pool of long-lived worker processes with bounded memory.
+
+    Each worker imports matplotlib and cartopy once and runs one task at
+    a time. A worker is replaced by a fresh process after max_tasks tasks
+    or when its resident memory exceeds max_rss, so memory stays bounded
+    however many frames are rendered. Tasks are dispatched in order
+    (submit_first jumps the queue) only when a worker is idle, so pending
+    futures can still be cancelled. The interface is that of a
+    concurrent.futures executor.
+
+    Workers are started with the 'forkserver' method where available: a
+    forked web process would share its open HDF5 files with the workers.
+    """
+    def __init__(self,max_workers=None,max_tasks=200,max_rss=1024*2**20,
+                 start_method='forkserver'):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_tasks   = max_tasks
+        self.max_rss     = max_rss
+        self.recycled    = 0
+        if start_method not in multiprocessing.get_all_start_methods():
+            start_method = None
+        self._ctx        = multiprocessing.get_context(start_method)
+        if start_method == 'forkserver':
+            self._ctx.set_forkserver_preload(PRELOAD)
+        self._workers    = []
+        self._pending    = deque()
+        self._lock       = threading.Lock()
+        self._wakeup_r, self._wakeup_w = multiprocessing.Pipe(duplex=False)
+        self._thread     = None
+        self._shutdown   = False
+
+    def submit(self,fn,*args):
+        return self._submit(fn,args,first=False)
+
+    def submit_first(self,fn,*args):
+        """Submit a task ahead of the pending ones (interactive requests)."""
+        return self._submit(fn,args,first=True)
+
+    def _submit(self,fn,args,first):
+        future = Future()
+        with self._lock:
+            if self._shutdown:
+                raise RuntimeError("cannot submit after shutdown")
+            if first:
+                self._pending.appendleft((future,fn,args))
+            else:
+                self._pending.append((future,fn,args))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._manage,daemon=True)
+                self._thread.start()
+        self._wakeup_w.send(None)
+        return future
+
+    def shutdown(self,wait=True):
+        with self._lock:
+            self._shutdown = True
+            for future,_,_ in self._pending:
+                future.cancel()
+            self._pending.clear()
+        self._wakeup_w.send(None)
+        if wait and self._thread is not None:
+            self._thread.join()
+
+    def _spawn(self):
+        worker = Worker(self._ctx,self.max_tasks,self.max_rss)
+        self._workers.append(worker)
+        return worker
+
+    def _retire(self,worker):
+        self._workers.remove(worker)
+        worker.conn.close()
+        worker.process.join()
+
+    def _dispatch(self):
+        with self._lock:
+            while self._pending:
+                idle = [w for w in self._workers if w.future is None]
+                if not idle:
+                    if len(self._workers) >= self.max_workers:
+                        break
+                    idle = [self._spawn()]
+                (future, fn, args) = self._pending.popleft()
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    idle[0].conn.send((fn,args))
+                    idle[0].future = future
+                except Exception as e:
+                    future.set_exception(e)
+                    self._retire(idle[0])
+
+    def _manage(self):
+        """Dispatch tasks and collect results (runs in a background thread)."""
+        while True:
+            self._dispatch()
+            if self._shutdown and not any(w.future for w in self._workers):
+                break
+            conns = [self._wakeup_r] + [w.conn for w in self._workers if w.future is not None]
+            for conn in wait(conns):
+                if conn is self._wakeup_r:
+                    self._wakeup_r.recv()
+                    continue
+                worker = next(w for w in self._workers if w.conn is conn)
+                future, worker.future = worker.future, None
+                try:
+                    (status, value, recycle) = conn.recv()
+                except (EOFError, OSError):
+                    (status, value, recycle) = ('error', RuntimeError("render worker died"), True)
+                if status == 'ok':
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+                if recycle:
+                    self.recycled += 1
+                    self._retire(worker)
+        for worker in list(self._workers):
+            worker.conn.send(None)
+            self._retire(worker)
@@ -1,4 +1,6 @@
 from flask_wtf import FlaskForm
+from wtforms import StringField, FloatField, SelectField
+from wtforms.validators import Regexp, DataRequired
 from wtforms_alchemy import model_form_factory
 from app.plot.models import PlotModel
 
@@ -8,3 +10,20 @@ class PlotForm(ModelForm):
     class Meta:
         model = PlotModel
 
+
+class EnsembleForm(FlaskForm):
+    thresholds  = StringField('Thresholds',
+                              default='0.1 1 10',
+                              validators=[Regexp(r'^[\d.eE+\- ]*$')])
+    percentiles = StringField('Percentiles',
+                              default='10 50 90',
+                              validators=[Regexp(r'^[\d. ]*$')])
+
+class DerivedForm(FlaskForm):
+    threshold   = FloatField('Arrival threshold', default=0.0)
+
+class CompareForm(FlaskForm):
+    profile     = SelectField('Compare with profile', coerce=int)
+    output      = StringField('Output file',
+                              default='config.res.nc',
+                              validators=[DataRequired(), Regexp(r'^[\w.\-]+\.nc$')])
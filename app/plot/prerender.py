@@ -0,0 +1,268 @@
+from collections import deque, OrderedDict
+from app.extensions import frames, metrics
+from app.fall3d.workers import RenderPool
+import threading
+import os
+
+# Outputs opened by a render worker, reused by its next frames
+_datasets = None
+
+def open_output(spec):
+    """Output opened by the current worker process (see Fall3D.spec)."""
+    global _datasets
+    from app.fall3d.registry import DatasetRegistry
+    if _datasets is None:
+        _datasets = DatasetRegistry(max_open=4,lazy=spec['lazy'],float32=spec['float32'])
+    f = _datasets.get(spec['path'],spec['fname'],spec['extent'])
+    if f is None:
+        raise FileNotFoundError(os.path.join(spec['path'],spec['fname']))
+    return f
+
+def render_frame(spec,settings,it):
+    """Render a single frame in a worker process.
+
+    Returns the PNG bytes and the render statistics (phase durations,
+    bytes read and image size).
+    """
+    from app.fall3d.metrics import Timer
+    timer = Timer()
+    with timer.phase('open'):
+        f = open_output(spec)
+    f = f.with_settings(settings)
+    data = f.plot(it).getvalue()
+    timer.phases.update(f.timer.phases)
+    info = {'phases':     timer.phases,
+            'bytes_read': f.bytes_read,
+            'size':       len(data)}
+    return data, info
+
+def render_comparison(spec_a,spec_b,settings,labels,mode,k):
+    """Render a comparison map of two outputs in a worker process."""
+    from app.fall3d.compare import Comparison
+    a = open_output(spec_a).with_settings(settings)
+    b = open_output(spec_b).with_settings(settings)
+    return Comparison(a,b,labels).plot(k,mode).getvalue()
+
+class Job:
+    """Pre-rendering of every time step for a given output file and settings.
+
+    futures holds the renders still pending only: a frame leaves it when
+    its render is done, failed or cancelled.
+    """
+    def __init__(self,path,file_id,settings,total,live=False):
+        self.path     = path
+        self.file_id  = file_id
+        self.settings = settings
+        self.total    = total
+        # The newest time step of a live output is rendered but not cached
+        self.newest   = total-1 if live else None
+        self.futures  = {}
+        self.done     = set()
+        self.failed   = set()
+
+    def key(self,it):
+        return (self.settings, it)
+
+    def matches(self,file_id,settings):
+        return self.file_id == file_id and self.settings == settings
+
+    def cancel(self):
+        for future in list(self.futures.values()):
+            future.cancel()
+
+    def finished(self):
+        return len(self.done) + len(self.failed) >= self.total
+
+    def progress(self):
+        return {'done':   len(self.done),
+                'failed': len(self.failed),
+                'total':  self.total}
+
+class Prerender:
+    """Render all frames of a run in a process pool, nearest frames first."""
+    def __init__(self,max_workers=None,max_tasks=200,max_rss=1024*2**20,
+                 start_method='forkserver',max_jobs=32):
+        self.max_workers  = max_workers
+        self.max_tasks    = max_tasks
+        self.max_rss      = max_rss
+        self.start_method = start_method
+        self.max_jobs     = max_jobs
+        self._executor   = None
+        self._jobs       = OrderedDict()
+        self._lock       = threading.Lock()
+
+    def init_app(self,app):
+        self.max_workers = app.config.get('PRERENDER_WORKERS', self.max_workers)
+        self.max_tasks   = app.config.get('RENDER_MAX_TASKS',  self.max_tasks)
+        self.max_rss     = app.config.get('RENDER_MAX_RSS',    self.max_rss)
+        self.start_method = app.config.get('RENDER_START_METHOD', self.start_method)
+        self.max_jobs    = app.config.get('PRERENDER_MAX_JOBS', self.max_jobs)
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = RenderPool(max_workers=self.max_workers,
+                                        max_tasks=self.max_tasks,
+                                        max_rss=self.max_rss,
+                                        start_method=self.start_method)
+        return self._executor
+
+    def submit(self,f,settings,it,first=False):
+        """Render a frame in the worker pool; the future gives (data,info)."""
+        submit = self.executor.submit_first if first else self.executor.submit
+        future = submit(render_frame,f.spec,settings,it)
+        future.add_done_callback(lambda fut: self._record(f,settings,it,fut))
+        return future
+
+    def _record(self,f,settings,it,future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        (data, info) = future.result()
+        metrics.record(info['phases'],info['bytes_read'],info['size'],
+                       file=f.filepath,key=settings[0],it=it)
+
+    def render(self,f,it):
+        """Render a frame of f in the worker pool, ahead of pre-rendering.
+
+        Returns the PNG bytes and the render statistics. A frame of the
+        current job (whose queued render may have been cancelled to get it
+        sooner) is then counted as done or failed by the job.
+        """
+        settings = tuple(f.settings)
+        job = self.get_job(f)
+        if job is not None and (not 0 <= it < job.total or not job.matches(f.file_id(),settings)):
+            job = None
+        try:
+            (data, info) = self.submit(f,settings,it,first=True).result()
+        except Exception:
+            if job is not None:
+                job.failed.add(it)
+            raise
+        if job is not None:
+            job.failed.discard(it)
+            job.done.add(it)
+        return data, info
+
+    def render_comparison(self,a,b,labels,mode,k):
+        """Render a comparison map in the worker pool and wait for it."""
+        return self.executor.submit_first(render_comparison,a.spec,b.spec,
+                                          tuple(a.settings),labels,mode,k).result()
+
+    def start(self,f,start=0,replaces=None):
+        """Schedule every time step of f using its settings.
+
+        The pending frames of the job with settings `replaces` (the
+        previous choice of the same user) are cancelled.
+        """
+        file_id  = f.file_id()
+        settings = tuple(f.settings)
+        times    = f.get_times()
+        job      = Job(f.path,file_id,settings,len(times),f.live)
+        with self._lock:
+            if replaces is not None and tuple(replaces) != settings:
+                previous = self._jobs.pop((f.filepath,tuple(replaces)),None)
+                if previous is not None:
+                    previous.cancel()
+            # Forget jobs of previous versions of the output file
+            for index in [k for k,j in self._jobs.items() if j.file_id[0] == f.filepath and j.file_id != file_id]:
+                self._jobs.pop(index).cancel()
+            self._jobs[(f.filepath,settings)] = job
+            self._jobs.move_to_end((f.filepath,settings))
+            self._evict()
+        for it in sorted(times, key=lambda i: (abs(i-start),i)):
+            if frames.contains(f.path,file_id,job.key(it)):
+                job.done.add(it)
+                continue
+            future = self.submit(f,settings,it)
+            # Registered before the callback, which removes it when done
+            job.futures[it] = future
+            future.add_done_callback(lambda fut,it=it: self._store(job,it,fut))
+        return job
+
+    def _evict(self):
+        """Forget the least recently used jobs above max_jobs, finished ones first."""
+        for index in [k for k,j in self._jobs.items() if j.finished()]:
+            if len(self._jobs) <= self.max_jobs:
+                return
+            del self._jobs[index]
+        while len(self._jobs) > self.max_jobs:
+            (_, job) = self._jobs.popitem(last=False)
+            job.cancel()
+
+    def _store(self,job,it,future):
+        # Finished futures hold the frame: keep only the pending ones
+        if job.futures.get(it) is future:
+            del job.futures[it]
+        if future.cancelled():
+            return
+        try:
+            data = future.result()[0]
+        except Exception as e:
+            print(f"Frame {it} failed: {e}")
+            job.failed.add(it)
+            return
+        if it != job.newest:
+            frames.put(job.path,job.file_id,job.key(it),data)
+        job.done.add(it)
+
+    def get_job(self,f):
+        index = (f.filepath,tuple(f.settings))
+        with self._lock:
+            job = self._jobs.get(index)
+            if job is not None:
+                self._jobs.move_to_end(index)
+        return job
+
+    def progress(self,f):
+        job = self.get_job(f)
+        if job is None:
+            return {'done': 0, 'failed': 0, 'total': 0}
+        return job.progress()
+
+    def pending(self,f,it):
+        """Return the pending future rendering frame it, if any."""
+        job = self.get_job(f)
+        if job is None or not job.matches(f.file_id(),tuple(f.settings)):
+            return None
+        future = job.futures.get(it)
+        if future is None or future.done():
+            return None
+        return future
+
+    def iter_frames(self,f,window=None):
+        """Yield the PNG frames of every time step in order.
+
+        Frames are rendered in the process pool, but at most `window`
+        frames are in flight or waiting to be consumed at any time.
+        """
+        file_id  = f.file_id()
+        settings = tuple(f.settings)
+        times    = f.get_times()
+        if window is None:
+            window = 2*(self.max_workers or os.cpu_count() or 1)
+        queue = deque()
+        for it in times:
+            queue.append((it,self._request(f,file_id,settings,it)))
+            if len(queue) >= window:
+                yield self._resolve(f,file_id,settings,*queue.popleft())
+        while queue:
+            yield self._resolve(f,file_id,settings,*queue.popleft())
+
+    def _request(self,f,file_id,settings,it):
+        data = frames.get(f.path,file_id,(settings,it))
+        if data is not None:
+            return data
+        future = self.pending(f,it)
+        if future is None:
+            future = self.submit(f,settings,it)
+        return future
+
+    def _resolve(self,f,file_id,settings,it,item):
+        if isinstance(item,bytes):
+            return item
+        data = item.result()[0]
+        if f.cacheable(it):
+            frames.put(f.path,file_id,(settings,it),data)
+        return data
+
+prerender = Prerender()
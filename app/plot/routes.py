@@ -1,60 +1,508 @@
-from flask import Blueprint, render_template, redirect, url_for, session, flash, current_app, send_file
+from flask import Blueprint, render_template, redirect, url_for, session, flash, current_app, send_file, abort, request, Response
 from app.models import Profiles
-from app.plot.forms import PlotForm
-from app.fall3d.post import Fall3D
+from app.extensions import frames, contours, datasets, metrics, live
+from app.plot.forms import PlotForm, EnsembleForm, DerivedForm, CompareForm
+from app.plot.prerender import prerender
+from app.fall3d.tiles import TileCache, render_tile, auto_levels
+from app.fall3d.animation import FORMATS, available_formats, get_writer
+from app.fall3d.cache import make_token
+from app.fall3d.slices import encode_slice
+from app.fall3d.contours import contour_bands, encode_geojson
+from app.fall3d.index import load_index, get_index, suggest_levels
+from app.fall3d.derived import derived_jobs
+from app.fall3d.ensemble import find_members, ensemble_jobs
 from app.profiles import profile_required
 from os.path import join
+import glob
+import io
+import os
+import json
+import queue
+import tempfile
 
 bp = Blueprint('plot', __name__)
 
-fobj = None
+tile_cache = TileCache()
 
-def get_fall3d():
-    global fobj
-    if fobj is None:
-        plabel = session['profile']
-        path = join(current_app.config['RUN_FOLDER'],plabel)
-        fobj = Fall3D(path,'config.res.nc')
-    return fobj
+def get_extent(p):
+    """Domain extent from the GRID section of a profile."""
+    for s in p.sections:
+        if s.label=='GRID':
+            return (s.f3, s.f4, s.f5, s.f6)
+    return None
+
+def get_run_folder(p):
+    return join(current_app.config['RUN_FOLDER'],p.label)
+
+def list_outputs(path):
+    """Output files in a run folder that can be plotted."""
+    fnames = ['config.res.nc']
+    for pattern in ('*.res.nc','*.ens.nc'):
+        for fname in sorted(glob.glob(join(path,pattern))):
+            fname = os.path.basename(fname)
+            if fname not in fnames:
+                fnames.append(fname)
+    return fnames
+
+def get_output(p=None,fname=None):
+    """Shared Fall3D object for the output of the loaded profile (or None)."""
+    if fname is None:
+        fname = session.get('plot_file','config.res.nc')
+    if p is None:
+        if session.get('id') is None:
+            return None
+        p = Profiles.query.get_or_404(session['id'])
+    path = get_run_folder(p)
+    return datasets.get(path,fname,get_extent(p))
+
+def get_output_index(p=None,fname=None):
+    """Sidecar index of the output, opening the dataset only if it is stale."""
+    if fname is None:
+        fname = session.get('plot_file','config.res.nc')
+    if p is None:
+        p = Profiles.query.get_or_404(session['id'])
+    path = get_run_folder(p)
+    index = load_index(path,fname)
+    if index is None:
+        f = get_output(p,fname)
+        if f is None:
+            return None
+        index = get_index(f)
+    return index
+
+def get_level(f,var):
+    """Level of a 4D variable given by the level argument (400 if out of range)."""
+    level = request.args.get('level',0,type=int)
+    labels = f.get_level_labels(var)
+    if labels and not 0 <= level < len(labels):
+        abort(400)
+    return level
+
+def get_view():
+    """Output of the loaded profile with the render settings of this session."""
+    settings = session.get('plot')
+    f = get_output()
+    if f is None or settings is None:
+        abort(404)
+    view = f.with_settings(settings)
+    view.live = session.get('plot_live',False)
+    return view
 
 @bp.route('/', methods = ['GET','POST'])
 @profile_required
 def index():
     form = PlotForm()
     context = { 'form': form,
+                'formats': available_formats(),
                 'show': False}
     id = session['id']
     p = Profiles.query.get_or_404(id)
-    f = get_fall3d()
-    if f.load():
-        form.f1.choices = [(i,i) for i in f.get_vars()]
-        form.f2.choices = [(i,str(i)) for i in f.get_times()]
+    path = get_run_folder(p)
+    outputs = list_outputs(path)
+    if 'live' in request.args:
+        session['plot_live'] = request.args.get('live') == '1'
+    context['live'] = session.get('plot_live',False)
+    output = request.args.get('output')
+    if output in outputs and output != session.get('plot_file'):
+        session['plot_file'] = output
+        session.pop('plot',None)
+    fname = session.get('plot_file','config.res.nc')
+    if fname not in outputs:
+        fname = session['plot_file'] = 'config.res.nc'
+    form.f0.choices = [(i,i) for i in outputs]
+    if not form.is_submitted():
+        form.f0.data = fname
+    context['members']       = len(find_members(path))
+    context['ensemble_form'] = EnsembleForm()
+    context['ensemble']      = ensemble_jobs.status(path)
+    context['derived_form']  = DerivedForm()
+    context['derived']       = derived_jobs.status(path,fname)
+    index = get_output_index(p,fname)
+    if index is not None:
+        form.f1.choices = [(i,i) for i in index['plot']]
+        form.f2.choices = [(i,t) for i,t in enumerate(index['times'])]
+        # Levels of the selected variable (FL, z-cuts, bins...)
+        key = form.f1.data if form.is_submitted() else (session.get('plot') or [None])[0]
+        if key not in index['plot'] and index['plot']:
+            key = index['plot'][0]
+        form.f8.choices = list(enumerate(index['levels'].get(key) or ['No levels']))
     else:
         flash("Error opening output file...")
     if form.validate_on_submit():
-        f.key    = form.f1.data
         it       = form.f2.data
-        f.minval = form.f3.data
-        f.maxval = form.f4.data
-        f.step   = form.f5.data
-        f.log    = form.f6.data
-        f.auto   = form.f7.data
+        auto     = form.f7.data
+        if auto:
+            # Use the same data-driven levels for every frame
+            # instead of the automatic levels of each frame
+            levels = suggest_levels(index,form.f1.data)
+            if levels is not None:
+                (form.f3.data, form.f4.data, form.f5.data) = levels
+                auto = False
+        settings = (form.f1.data,
+                    form.f3.data,
+                    form.f4.data,
+                    form.f5.data,
+                    form.f6.data,
+                    auto,
+                    form.f8.data)
+        previous = session.get('plot')
+        session['plot'] = settings
+        view = get_output(p).with_settings(settings)
+        view.live = context['live']
+        prerender.start(view,start=it,replaces=previous)
         context['show'] = True
     return render_template('plot/index.html', **context)
 
+def get_frame(f,it):
+    """Return the rendered frame from the cache, rendering it if needed,
+    and the bytes read from the output to render it (0 if cached)."""
+    file_id = f.file_id()
+    key = (f.settings, it)
+    data = frames.get(f.path,file_id,key)
+    metrics.cache_hit(data is not None)
+    bytes_read = 0
+    if data is None:
+        future = prerender.pending(f,it)
+        if future is not None and not future.cancel():
+            # Already being rendered in the background
+            try:
+                (data, info) = future.result()
+                bytes_read = info['bytes_read']
+            except Exception:
+                data = None
+    if data is None:
+        # Figures are never rendered in the web process
+        (data, info) = prerender.render(f,it)
+        bytes_read = info['bytes_read']
+        if f.cacheable(it):
+            frames.put(f.path,file_id,key,data)
+    return io.BytesIO(data), bytes_read
+
 @bp.route('/update/<int:it>')
 def update(it):
     # Generate the plot based on the index
-    buf = fobj.plot(it)
-    return send_file(buf, mimetype='image/png')
+    f = get_view()
+    (buf, bytes_read) = get_frame(f,it)
+    response = send_file(buf, mimetype='image/png')
+    response.headers['X-Bytes-Read'] = bytes_read
+    return response
+
+@bp.route('/live')
+def live_events():
+    """Server-sent events announcing the time steps appended to the output."""
+    f = get_view()
+    path, fname, extent = f.path, f.fname, f.extent
+    q = live.subscribe(path,fname,extent)
+    def stream():
+        try:
+            yield 'retry: 5000\n\n'
+            while True:
+                try:
+                    event = q.get(timeout=15)
+                except queue.Empty:
+                    yield ': keep-alive\n\n'
+                    continue
+                yield f"event: frame\ndata: {json.dumps(event)}\n\n"
+        finally:
+            live.unsubscribe(path,fname,q)
+    return Response(stream(),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
+
+@bp.route('/progress')
+def progress():
+    return prerender.progress(get_view())
 
 @bp.route('/download/<int:it>')
 def download(it):
     # Generate the plot based on the index
-    buf = fobj.plot(it)
-    fname = f'{fobj.key}-{it}.png'
-    return send_file(buf, 
+    f = get_view()
+    (buf, bytes_read) = get_frame(f,it)
+    fname = f'{f.key}-{it}.png'
+    response = send_file(buf, 
                      as_attachment=True, 
                      download_name=fname, 
                      mimetype='image/png')
+    response.headers['X-Bytes-Read'] = bytes_read
+    return response
+
+
+def get_comparison():
+    """Comparison of the current plot with the output chosen in /compare."""
+    other = session.get('compare')
+    if other is None:
+        abort(404)
+    from app.fall3d.compare import Comparison
+    a = get_view()
+    q = Profiles.query.get_or_404(other[0])
+    b = get_output(q,other[1])
+    if b is None:
+        abort(404)
+    p = Profiles.query.get_or_404(session['id'])
+    try:
+        return Comparison(a,b.with_settings(a.settings),(p.label,q.label))
+    except KeyError:
+        abort(404)
+
+@bp.route('/compare', methods = ['GET','POST'])
+@profile_required
+def compare():
+    """Compare the current plot with the output of another profile."""
+    from app.fall3d.compare import MODES
+    if session.get('plot') is None:
+        flash("Plot a variable first")
+        return redirect(url_for('plot.index'))
+    form = CompareForm()
+    form.profile.choices = [(q.id,q.label) for q in Profiles.query.order_by(Profiles.label)]
+    if form.validate_on_submit():
+        q = Profiles.query.get_or_404(form.profile.data)
+        if get_output(q,form.output.data) is None:
+            flash(f"Error opening {form.output.data} of profile {q.label}")
+            session.pop('compare',None)
+        else:
+            session['compare'] = (q.id,form.output.data)
+    elif session.get('compare') is not None:
+        (form.profile.data, form.output.data) = session['compare']
+    context = {'form':  form,
+               'modes': MODES,
+               'key':   session['plot'][0],
+               'times': []}
+    if session.get('compare') is not None:
+        context['times'] = get_comparison().get_times()
+        if not context['times']:
+            flash("The outputs have no times in common")
+    return render_template('plot/compare.html', **context)
+
+@bp.route('/compare/<mode>/<int:k>')
+def compare_frame(mode,k):
+    """Side-by-side, difference or ratio map of the k-th common time."""
+    from app.fall3d.compare import MODES
+    if mode not in MODES:
+        abort(404)
+    c = get_comparison()
+    if not 0 <= k < len(c):
+        abort(404)
+    a, b = c.a, c.b
+    file_id = a.file_id()
+    key = ('compare', b.file_id(), a.settings, c.labels, mode, k)
+    data = frames.get(a.path,file_id,key)
+    if data is None:
+        data = prerender.render_comparison(a,b,c.labels,mode,k)
+        frames.put(a.path,file_id,key,data)
+    return send_file(io.BytesIO(data), mimetype='image/png')
+
+@bp.route('/compare/metrics')
+def compare_metrics():
+    """Per-time summary metrics (bias, MAE, RMSE, FMS...) of the comparison."""
+    c = get_comparison()
+    threshold = request.args.get('threshold',None,type=float)
+    return {'var':       c.key,
+            'labels':    list(c.labels),
+            'threshold': c.threshold() if threshold is None else threshold,
+            'regridded': not c.regrid.identity,
+            'metrics':   c.metrics(threshold)}
+
+@bp.route('/metrics')
+def render_metrics():
+    """Rolling render statistics (JSON, or plain text with ?format=text)."""
+    if request.args.get('format') == 'text':
+        return Response(metrics.to_text(), mimetype='text/plain')
+    return metrics.summary()
+
+@bp.route('/ensemble', methods = ['POST'])
+@profile_required
+def ensemble():
+    p = Profiles.query.get_or_404(session['id'])
+    form = EnsembleForm()
+    if form.validate_on_submit():
+        thresholds  = form.thresholds.data.split()
+        percentiles = form.percentiles.data.split()
+        started = ensemble_jobs.start(get_run_folder(p),
+                                      thresholds,
+                                      percentiles,
+                                      max_workers=current_app.config['PRERENDER_WORKERS'])
+        if started:
+            flash("Started ensemble post-processing")
+        else:
+            flash("Ensemble post-processing is already running")
+    else:
+        flash("Invalid thresholds or percentiles")
+    return redirect(url_for('plot.index'))
+
+@bp.route('/derived', methods = ['POST'])
+@profile_required
+def derived():
+    p = Profiles.query.get_or_404(session['id'])
+    form = DerivedForm()
+    path = get_run_folder(p)
+    fname = session.get('plot_file','config.res.nc')
+    if not os.path.isfile(join(path,fname)):
+        flash("Error opening output file...")
+    elif form.validate_on_submit():
+        if derived_jobs.start(path,fname,form.threshold.data):
+            flash("Started computing derived products")
+        else:
+            flash("Derived products are already being computed")
+    return redirect(url_for('plot.index'))
+
+@bp.route('/stats/<var>')
+def stats(var):
+    """Metadata, statistics and suggested levels of a variable."""
+    index = get_output_index()
+    if index is None or var not in index['plot']:
+        abort(404)
+    levels = suggest_levels(index,var)
+    return {'var':    var,
+            'meta':   index['vars'][var],
+            'times':  index['times'],
+            'stats':  index['stats'][var],
+            'zlevels': index['levels'].get(var,[]),
+            'levels': dict(zip(('minval','maxval','step'),levels))}
+
+@bp.route('/series/<var>')
+def series(var):
+    """Time series at points given as repeated lon=..&lat=.. arguments
+    (and level=.. for 4D variables)."""
+    try:
+        lons = [float(x) for x in request.args.getlist('lon')]
+        lats = [float(x) for x in request.args.getlist('lat')]
+    except ValueError:
+        abort(400)
+    if not lons or len(lons) != len(lats):
+        abort(400)
+    f = get_output()
+    if f is None or var not in f.get_vars(derived=False):
+        abort(404)
+    f = f.with_settings()
+    f.level = get_level(f,var)
+    values = f.get_series(var,lons,lats)
+    # From the dataset: building a stale index would take much longer
+    times = [str(t) for t in f.ds['time'].dt.strftime("%Y-%m-%dT%H:%M:%S").values]
+    points = [{'lon':    lon,
+               'lat':    lat,
+               'values': [None if v!=v else float(v) for v in row]}
+              for lon,lat,row in zip(lons,lats,values)]
+    return {'var':    var,
+            'units':  f.ds[var].attrs.get('units'),
+            'times':  times,
+            'points': points}
+
+@bp.route('/animation/<fmt>')
+def animation(fmt):
+    f = get_view()
+    if fmt not in available_formats():
+        abort(404)
+    # Animations are stored in the run folder and reused while
+    # the output file, its time steps and the plot settings remain the same
+    folder = join(f.path,'animations')
+    token = make_token(f.file_id(),len(f.get_times()),f.settings)
+    fname = join(folder,f'{f.key}-{token}.{fmt}')
+    if not os.path.isfile(fname):
+        os.makedirs(folder, exist_ok=True)
+        # Own temporary file: concurrent requests may export the same animation
+        (fd, tmp) = tempfile.mkstemp(dir=folder, suffix='.'+fmt)
+        os.close(fd)
+        try:
+            writer = get_writer(fmt,tmp,len(f.get_times()),
+                                fps = current_app.config['ANIMATION_FPS'])
+            try:
+                for data in prerender.iter_frames(f):
+                    writer.add(data)
+            finally:
+                writer.close()
+            os.replace(tmp,fname)
+        except BaseException:
+            os.remove(tmp)
+            raise
+    return send_file(fname,
+                     as_attachment=True,
+                     download_name=f'{f.key}.{fmt}',
+                     mimetype=FORMATS[fmt])
+
+@bp.route('/tiles/<var>/<int:it>/<int:z>/<int:x>/<int:y>.png')
+def tiles(var,it,z,x,y):
+    f = get_view()
+    if var not in f.get_vars():
+        abort(404)
+    if not 0 <= it < f.ds.sizes['time']:
+        abort(404)
+    da = f.get_data(var,it)
+    file_id = f.file_id()
+    cacheable = f.cacheable(it)
+    levels = f.get_levels()
+    if levels is None:
+        # Automatic levels must be the same for every tile of a frame
+        lkey = (file_id,var,it,f.level)
+        levels = tile_cache.get('levels',lkey)
+        if levels is None:
+            levels = auto_levels(float(da.min()),float(da.max()))
+            if cacheable:
+                tile_cache.put('levels',lkey,levels)
+    key = (file_id,var,it,f.level,tuple(levels),x,y)
+    data = tile_cache.get(z,key)
+    if data is None:
+        data = render_tile(da,levels,z,x,y)
+        if cacheable:
+            tile_cache.put(z,key,data)
+    return send_file(io.BytesIO(data), mimetype='image/png')
+
+@bp.route('/slice/<var>/<int:it>')
+def field_slice(var,it):
+    """Binary field for client-side rendering (see encode_slice),
+    at the level given by the level argument for 4D variables."""
+    f = get_output()
+    if f is None or var not in f.get_vars():
+        abort(404)
+    if not 0 <= it < f.ds.sizes['time']:
+        abort(404)
+    dtype    = request.args.get('dtype','float32')
+    compress = request.args.get('compress','0') in ('1','true','zlib')
+    if dtype not in ('float32','uint16'):
+        abort(400)
+    f  = f.with_settings()
+    f.level = get_level(f,var)
+    da = f.get_field(var,it)
+    meta = {'var':   var,
+            'it':    it,
+            'level': f.level,
+            'time':  None if f.is_derived(var) else da['time'].dt.strftime("%Y-%m-%dT%H:%M:%S").item()}
+    response = Response(encode_slice(da,dtype,compress,meta),
+                        mimetype='application/octet-stream')
+    response.headers['X-Bytes-Read'] = f.bytes_read
+    return response
+
+@bp.route('/geojson/<var>/<int:it>')
+def geojson(var,it):
+    """Contour bands as GeoJSON polygons with lower/upper level attributes.
 
+    The levels are those of the current plot settings and the polygons
+    are simplified to the tolerance argument (degrees).
+    """
+    f = get_view()
+    if var not in f.get_vars():
+        abort(404)
+    if not 0 <= it < f.ds.sizes['time']:
+        abort(404)
+    tolerance = request.args.get('tolerance',0.0,type=float)
+    if tolerance < 0:
+        abort(400)
+    file_id = f.file_id()
+    da = f.get_data(var,it)
+    levels = f.get_levels()
+    if levels is None:
+        levels = auto_levels(float(da.min()),float(da.max()))
+    key = (var,it,f.level,tuple(levels),tolerance)
+    data = contours.get(f.path,file_id,key)
+    if data is None:
+        bands = contour_bands(f.get_field(var,it),levels,tolerance)
+        data = encode_geojson(bands,{'var':   var,
+                                     'it':    it,
+                                     'units': da.attrs.get('units')})
+        if f.cacheable(it):
+            contours.put(f.path,file_id,key,data)
+    response = send_file(io.BytesIO(data),
+                         mimetype='application/geo+json',
+                         download_name=f'{var}-{it}.geojson')
+    response.headers['X-Bytes-Read'] = f.bytes_read
+    return response
@@ -3,7 +3,6 @@ from flask_wtf import FlaskForm
 from wtforms import SelectField
 from wtforms_alchemy import model_form_factory
 from app.models import Profiles
-import pandas as pd
 
 # Initialize an empty list to store choices
 choices_list = []
@@ -11,6 +10,7 @@ choices_list = []
 def load_choices():
     global choices_list
     if not choices_list:
+        import pandas as pd
         with current_app.open_resource('static/volcano_list.pkl') as f:
             df = pd.read_pickle(f)
         choices_list = [("","")]
@@ -18,6 +18,7 @@ def load_choices():
     return choices_list
 
 def get_volcano_data(index):
+    import pandas as pd
     with current_app.open_resource('static/volcano_list.pkl') as f:
         df = pd.read_pickle(f)
         res = {col: df[col].iloc[index] for col in df}
@@ -0,0 +1,327 @@
+import os
+import re
+import time
+import signal
+import subprocess
+from datetime import datetime
+
+def parse_time(value):
+    """SLURM time limit in seconds (minutes, MM:SS, HH:MM:SS, D-HH[:MM[:SS]])."""
+    if value is None or value in ('', 'UNLIMITED', 'infinite'):
+        return None
+    days = 0
+    if '-' in value:
+        (d, value) = value.split('-',1)
+        days = int(d)
+        parts = [int(x) for x in value.split(':')]
+        parts += [0]*(3-len(parts))
+        (h, m, s) = parts
+    else:
+        parts = [int(x) for x in value.split(':')]
+        if len(parts) == 1:
+            (h, m, s) = (0, parts[0], 0)
+        elif len(parts) == 2:
+            (h, m, s) = (0, parts[0], parts[1])
+        else:
+            (h, m, s) = parts
+    return ((days*24 + h)*60 + m)*60 + s
+
+def parse_array(value):
+    """Task ids of a SLURM array specification (e.g. 0-9, 1,3,5-7, 0-99%10)."""
+    if not value:
+        return None
+    value = value.split('%')[0]
+    ids = []
+    for item in value.split(','):
+        step = 1
+        if ':' in item:
+            (item, step) = item.split(':')
+            step = int(step)
+        if '-' in item:
+            (a, b) = item.split('-')
+            ids += list(range(int(a),int(b)+1,step))
+        else:
+            ids.append(int(item))
+    return ids
+
+def parse_directives(fname):
+    """Options of the #SBATCH lines of a batch script."""
+    options = {}
+    with open(fname) as f:
+        for line in f:
+            m = re.match(r'#SBATCH\s+--([\w-]+)(?:[=\s]+(\S+))?', line)
+            if m:
+                options[m.group(1)] = m.group(2)
+    return options
+
+class LocalTask:
+    def __init__(self,job_id,index,ncores,deadline=None):
+        self.job_id   = job_id
+        self.index    = index
+        self.ncores   = ncores
+        self.deadline = deadline
+        self.proc     = None
+        self.code     = None
+        self.timeout  = False
+
+class LocalBackend:
+    """Process-based stand-in for a batch scheduler.
+
+    Batch scripts are run with bash, honouring the --ntasks (cores),
+    --time (the process group is killed when the limit is reached) and
+    --array (one process per task, with SLURM_ARRAY_TASK_ID set) options
+    of their #SBATCH lines. Tasks start in submission order while the used
+    cores stay within max_cores; a task requesting more cores than
+    available runs alone.
+    """
+    name = 'local'
+
+    def __init__(self,max_cores=None):
+        self.max_cores = max_cores or os.cpu_count() or 1
+        self._pending  = []
+        self._running  = []
+        self._tasks    = {}
+
+    def submit(self,job):
+        options = parse_directives(job.script)
+        ncores  = int(options.get('ntasks') or 1)
+        limit   = parse_time(options.get('time'))
+        ids     = parse_array(options.get('array')) or [None]
+        tasks   = [LocalTask(job.id,i,ncores,limit) for i in ids]
+        self._tasks[job.id] = tasks
+        self._pending += tasks
+        job.ncores       = ncores
+        job.time_limit   = limit
+        job.array_size   = len(ids) if ids != [None] else None
+        job.scheduler_id = f'local-{os.getpid()}-{job.id}'
+        job.stdout = os.path.join(job.path,f'job_{job.id}.out')
+        job.stderr = os.path.join(job.path,f'job_{job.id}.err')
+
+    def cancel(self,job):
+        tasks = self._tasks.get(job.id)
+        if tasks is None:
+            # Started by another web process
+            if job.pid:
+                try:
+                    os.killpg(job.pid, signal.SIGTERM)
+                    return True
+                except OSError:
+                    return False
+            return False
+        self._pending = [t for t in self._pending if t.job_id != job.id]
+        for t in tasks:
+            if t.proc is None:
+                t.code = -signal.SIGTERM
+            elif t.code is None:
+                try:
+                    os.killpg(t.proc.pid, signal.SIGTERM)
+                except OSError:
+                    pass
+        return True
+
+    def _start(self,job,task):
+        env = dict(os.environ)
+        suffix = ''
+        if task.index is not None:
+            env['SLURM_ARRAY_TASK_ID'] = str(task.index)
+            suffix = f'_{task.index}'
+        env['SLURM_NTASKS'] = str(task.ncores)
+        (root, ext) = os.path.splitext(job.stdout)
+        with open(f'{root}{suffix}{ext}','ab') as out, \
+             open(f'{os.path.splitext(job.stderr)[0]}{suffix}.err','ab') as err:
+            task.proc = subprocess.Popen(['bash', job.script],
+                                         cwd               = job.path,
+                                         env               = env,
+                                         stdout            = out,
+                                         stderr            = err,
+                                         stdin             = subprocess.DEVNULL,
+                                         start_new_session = True)
+        if task.deadline is not None:
+            task.deadline += time.monotonic()
+        self._running.append(task)
+        return task.proc.pid
+
+    def poll(self,jobs):
+        """Advance the local queue and return {job id: changes} of the jobs."""
+        jobs = {j.id: j for j in jobs}
+        changes = {}
+        now = time.monotonic()
+        for task in list(self._running):
+            code = task.proc.poll()
+            if code is None and task.deadline is not None and now > task.deadline:
+                task.timeout = True
+                try:
+                    os.killpg(task.proc.pid, signal.SIGTERM)
+                except OSError:
+                    pass
+            if code is not None:
+                task.code = code
+                self._running.remove(task)
+        # Cores used by the jobs of other web processes
+        used = sum(j.ncores for j in jobs.values() if j.id not in self._tasks and j.status == 'running')
+        used += sum(t.ncores for t in self._running)
+        for task in list(self._pending):
+            if used + task.ncores > self.max_cores and used > 0:
+                break
+            job = jobs.get(task.job_id)
+            self._pending.remove(task)
+            if job is None:
+                # Deleted with its profile
+                self._tasks.pop(task.job_id,None)
+                continue
+            try:
+                pid = self._start(job,task)
+            except OSError as e:
+                print(f"Job {job.id} failed to start: {e}")
+                task.code = 127
+                continue
+            used += task.ncores
+            state = changes.setdefault(job.id,{})
+            state['pid'] = pid
+            if job.status != 'running':
+                state.update({'status': 'running', 'started': datetime.now()})
+        for id, job in jobs.items():
+            tasks = self._tasks.get(id)
+            if tasks is None:
+                # Jobs left by a web process that no longer exists
+                owner = int(job.scheduler_id.split('-')[1]) if job.scheduler_id else None
+                if (owner and owner != os.getpid() and _alive(owner)) or (job.pid and _alive(job.pid)):
+                    continue
+                changes[id] = {'status':   'cancelled' if job.status == 'cancelled' else 'failed',
+                               'finished': datetime.now()}
+                continue
+            if any(t.code is None for t in tasks):
+                continue
+            del self._tasks[id]
+            codes = [t.code for t in tasks]
+            if any(t.timeout for t in tasks):
+                status = 'timeout'
+            elif job.status == 'cancelled':
+                status = 'cancelled'
+            else:
+                status = 'finished' if all(c == 0 for c in codes) else 'failed'
+            changes.setdefault(id,{}).update({'status':    status,
+                                              'exit_code': max(codes, key=abs),
+                                              'finished':  datetime.now()})
+        return changes
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+# Final states of sacct mapped to job status
+SLURM_STATES = {'COMPLETED':     'finished',
+                'FAILED':        'failed',
+                'NODE_FAIL':     'failed',
+                'OUT_OF_MEMORY': 'failed',
+                'BOOT_FAIL':     'failed',
+                'DEADLINE':      'timeout',
+                'TIMEOUT':       'timeout',
+                'PREEMPTED':     'failed',
+                'CANCELLED':     'cancelled'}
+
+class SlurmBackend:
+    """Submit batch scripts with sbatch and follow them with squeue/sacct.
+
+    The status of all the active jobs is obtained with one squeue call and
+    one sacct call for the jobs that left the queue, at most every
+    `interval` seconds, whatever the number of jobs.
+    """
+    name = 'slurm'
+
+    def __init__(self,interval=30.0):
+        self.interval = interval
+        self._last    = 0.0
+
+    @staticmethod
+    def _run(args):
+        return subprocess.run(args, capture_output=True, text=True, timeout=60)
+
+    def submit(self,job):
+        options = parse_directives(job.script)
+        res = self._run(['sbatch', '--parsable', f'--chdir={job.path}', job.script])
+        if res.returncode != 0:
+            raise RuntimeError(res.stderr.strip() or 'sbatch failed')
+        job.scheduler_id = res.stdout.strip().split(';')[0]
+        job.ncores       = int(options.get('ntasks') or 1)
+        job.time_limit   = parse_time(options.get('time'))
+        ids = parse_array(options.get('array'))
+        job.array_size   = len(ids) if ids else None
+        name = options.get('job-name') or os.path.basename(job.script)
+        def expand(pattern):
+            for k, v in (('%x',name), ('%j',job.scheduler_id), ('%A',job.scheduler_id)):
+                pattern = pattern.replace(k,v)
+            return os.path.join(job.path,pattern)
+        job.stdout = expand(options.get('output') or 'slurm-%j.out')
+        job.stderr = expand(options.get('error')  or options.get('output') or 'slurm-%j.out')
+        self._last = 0.0
+
+    def cancel(self,job):
+        if job.scheduler_id is None:
+            return False
+        return self._run(['scancel', job.scheduler_id]).returncode == 0
+
+    def poll(self,jobs):
+        jobs = [j for j in jobs if j.scheduler_id]
+        if not jobs or time.monotonic() - self._last < self.interval:
+            return {}
+        self._last = time.monotonic()
+        ids = ','.join(j.scheduler_id for j in jobs)
+        # Array tasks appear as <id>_<task> or <id>_[range]
+        queued = {}
+        res = self._run(['squeue', '-h', '-o', '%i|%T', '-j', ids])
+        for line in res.stdout.splitlines():
+            (jid, state) = line.split('|')
+            queued.setdefault(jid.split('_')[0],set()).add(state)
+        changes = {}
+        finished = []
+        for job in jobs:
+            states = queued.get(job.scheduler_id)
+            if states is None:
+                finished.append(job)
+            elif 'RUNNING' in states and job.status != 'running':
+                changes[job.id] = {'status': 'running', 'started': datetime.now()}
+        if not finished:
+            return changes
+        res = self._run(['sacct', '-n', '-P', '-X', '-o', 'JobID,State,ExitCode,Start,End',
+                         '-j', ','.join(j.scheduler_id for j in finished)])
+        accounting = {}
+        for line in res.stdout.splitlines():
+            (jid, state, code, start, end) = line.split('|')
+            accounting.setdefault(jid.split('_')[0],[]).append((state.split()[0], code, start, end))
+        for job in finished:
+            rows = accounting.get(job.scheduler_id)
+            if not rows:
+                # Not yet in the accounting database
+                continue
+            states = [SLURM_STATES.get(r[0]) for r in rows]
+            if None in states:
+                continue
+            for status in ('cancelled','timeout','failed','finished'):
+                if status in states:
+                    break
+            # ExitCode is <exit code>:<signal>
+            codes = [int(c) or -int(s) for (c, s) in (r[1].split(':') for r in rows)]
+            changes[job.id] = {'status':    status,
+                               'exit_code': max(codes, key=abs),
+                               'started':   _parse_date(min(r[2] for r in rows)),
+                               'finished':  _parse_date(max(r[3] for r in rows))}
+        return changes
+
+def _parse_date(value):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return datetime.now()
+
+def get_backend(name,**kwargs):
+    if name == 'slurm':
+        return SlurmBackend(interval=kwargs.get('interval',30.0))
+    if name == 'local':
+        return LocalBackend(max_cores=kwargs.get('max_cores'))
+    raise ValueError(f"Unknown run backend: {name}")
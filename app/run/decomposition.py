@@ -0,0 +1,145 @@
+import math
+
+# Thinnest subdomain (cells along a direction) and widest halo
+MIN_CELLS = 4
+HALO      = 2
+
+# Cost of a halo cell relative to an interior cell before any fit
+HALO_COST = 2.0
+
+def grid_cells(grid):
+    """Number of cells (nx, ny, nz) of a GRID section."""
+    def cells(n,resolution,lo,hi,dx):
+        if resolution:
+            return max(int(math.ceil(round((hi - lo)/dx, 6))), 1)
+        return n
+    nx = cells(grid.f7, grid.f8, grid.f3, grid.f4, grid.f9)
+    ny = cells(grid.f10,grid.f11,grid.f5, grid.f6, grid.f12)
+    return (nx, ny, grid.f13)
+
+def subdomain(cells,layout):
+    """Largest subdomain (cells along each direction) of a layout."""
+    return tuple(-(-n//p) for n, p in zip(cells,layout))
+
+def halo_surface(cells,layout):
+    """Halo cells exchanged by the largest subdomain."""
+    (sx, sy, sz) = subdomain(cells,layout)
+    faces = 0
+    if layout[0] > 1: faces += 2*sy*sz
+    if layout[1] > 1: faces += 2*sx*sz
+    if layout[2] > 1: faces += 2*sx*sy
+    return HALO*faces
+
+def imbalance(cells,layout):
+    """Largest subdomain relative to the mean one (1: perfect balance)."""
+    largest = math.prod(subdomain(cells,layout))
+    return largest*math.prod(layout)/math.prod(cells)
+
+def features(cells,layout):
+    return (math.prod(subdomain(cells,layout)), halo_surface(cells,layout))
+
+class CostModel:
+    """Wall seconds per simulated hour: a*volume + b*halo + c per rank.
+
+    volume and halo are the interior and halo cells of the largest
+    subdomain. Without fitted coefficients only the relative cost of the
+    layouts is meaningful (seconds is None).
+    """
+    def __init__(self,a=1.0,b=HALO_COST,c=0.0,fitted=False,samples=0):
+        self.a       = a
+        self.b       = b
+        self.c       = c
+        self.fitted  = fitted
+        self.samples = samples
+
+    def cost(self,cells,layout):
+        (volume, halo) = features(cells,layout)
+        return self.a*volume + self.b*halo + self.c
+
+    def seconds(self,cells,layout):
+        return self.cost(cells,layout) if self.fitted else None
+
+    @classmethod
+    def fit(cls,records,min_samples=3):
+        """Least-squares fit on (cells, layout, seconds per simulated hour) records.
+
+        Negative coefficients (not physical, from noisy timings) are
+        dropped and the fit repeated without them. Falls back to the
+        default model with fewer than min_samples records.
+        """
+        if len(records) < min_samples:
+            return cls(samples=len(records))
+        import numpy as np
+        X = np.array([features(c,l) + (1.0,) for (c, l, _) in records], dtype=float)
+        y = np.array([t for (_, _, t) in records], dtype=float)
+        active = [0, 1, 2]
+        while True:
+            coef = np.zeros(3)
+            coef[active] = np.linalg.lstsq(X[:,active], y, rcond=None)[0]
+            negative = [i for i in active if coef[i] < 0]
+            if not negative:
+                break
+            active = [i for i in active if i not in negative]
+            if not active:
+                return cls(samples=len(records))
+        if coef[0] <= 0:
+            return cls(samples=len(records))
+        return cls(*coef, fitted=True, samples=len(records))
+
+def check(cells,layout,nens=1,cores=None):
+    """Reasons to refuse a layout (empty if acceptable)."""
+    problems = []
+    for name, n, p in zip('XYZ',cells,layout):
+        if p < 1:
+            problems.append(f"N{name} must be positive")
+        elif p > 1 and n//p < MIN_CELLS:
+            problems.append(f"N{name}={p} leaves subdomains thinner than {MIN_CELLS} cells "
+                            f"({n} cells along {name})")
+    if problems:
+        return problems
+    ranks = math.prod(layout)*nens
+    if cores is not None and ranks > cores:
+        problems.append(f"{ranks} processes exceed the {cores} available cores")
+    (volume, halo) = features(cells,layout)
+    if halo > volume:
+        problems.append(f"subdomains exchange more halo cells ({halo}) than they compute ({volume})")
+    if imbalance(cells,layout) > 1.5:
+        problems.append(f"subdomains are unbalanced by {100*(imbalance(cells,layout)-1):.0f}%")
+    return problems
+
+def advise(cells,cores,nens=1,model=None,top=5):
+    """Best layouts (px, py, pz) for the available cores, cheapest first."""
+    model = model or CostModel()
+    ranks = max(cores//max(nens,1),1)
+    limits = [max(n//MIN_CELLS,1) for n in cells]
+    options = []
+    for px in range(1,min(limits[0],ranks)+1):
+        for py in range(1,min(limits[1],ranks//px)+1):
+            for pz in range(1,min(limits[2],ranks//(px*py))+1):
+                layout = (px, py, pz)
+                if check(cells,layout,nens,cores):
+                    continue
+                options.append((model.cost(cells,layout), -math.prod(layout), layout))
+    options.sort()
+    return [{'layout':    layout,
+             'processes': math.prod(layout)*nens,
+             'subdomain': subdomain(cells,layout),
+             'halo':      halo_surface(cells,layout),
+             'imbalance': imbalance(cells,layout),
+             'cost':      cost,
+             'seconds':   model.seconds(cells,layout)}
+            for (cost, _, layout) in options[:top]]
+
+def job_records(jobs):
+    """(cells, layout, seconds per simulated hour) of finished single runs."""
+    records = []
+    for job in jobs:
+        if job.status != 'finished' or job.array_size or not (job.layout and job.grid and job.sim_hours):
+            continue
+        if job.started is None or job.finished is None:
+            continue
+        seconds = (job.finished - job.started).total_seconds()
+        layout = tuple(int(x) for x in job.layout.split('x'))
+        cells  = tuple(int(x) for x in job.grid.split('x'))
+        records.append((cells, layout[:3], seconds/job.sim_hours))
+    return records
@@ -1,9 +1,41 @@
 from flask_wtf import FlaskForm
+from wtforms import ValidationError, StringField, TextAreaField, SelectField, IntegerField, BooleanField
+from wtforms.validators import DataRequired, Regexp, Optional, NumberRange
 from wtforms_alchemy import model_form_factory
 from app.run.models import RunModel
+from app.run.backends import parse_time
+from app.run.decomposition import check
 
 ModelForm = model_form_factory(FlaskForm)
 
 class RunForm(ModelForm):
     class Meta:
         model = RunModel
+
+    def validate_f5(self,field):
+        try:
+            parse_time(field.data)
+        except ValueError:
+            raise ValidationError("Time limit must be [D-]HH:MM:SS")
+
+    def check_layout(self,cells,cores=None):
+        """Refuse bad decompositions of a grid (errors are added to NX)."""
+        problems = check(cells,
+                         (self.f1.data,self.f2.data,self.f3.data),
+                         self.f4.data,
+                         cores)
+        self.f1.errors = list(self.f1.errors) + problems
+        return not problems
+
+class SweepForm(RunForm):
+    name        = StringField('Sweep name',
+                              validators=[DataRequired(), Regexp(r'^[\w\-]+$')])
+    parameters  = TextAreaField('Parameters',
+                              validators=[DataRequired()])
+    method      = SelectField('Sampling',
+                              choices=[('cartesian','Cartesian product'),('lhs','Latin hypercube')])
+    samples     = IntegerField('Samples (Latin hypercube)',
+                              validators=[Optional(), NumberRange(min=1)])
+    seed        = IntegerField('Random seed',
+                              validators=[Optional()])
+    array       = BooleanField('Submit as a job array', default=True)
@@ -0,0 +1,125 @@
+import threading
+from datetime import datetime
+from app.run.backends import get_backend
+
+class JobRunner:
+    """Submit queued jobs to a batch backend and follow their status.
+
+    A background thread (one per web process, started on first use)
+    hands queued jobs to the backend in submission order and applies the
+    status changes reported by the backend, which queries all the active
+    jobs at once. Jobs are claimed with a conditional update, so several
+    web processes never submit the same job. The backend is selected with
+    RUN_BACKEND ('local' or 'slurm').
+    """
+    def __init__(self,backend=None,interval=2.0):
+        self.backend   = backend
+        self.interval  = interval
+        self.app       = None
+        self._thread   = None
+        self._wakeup   = threading.Event()
+        self._lock     = threading.Lock()
+
+    def init_app(self,app):
+        self.app      = app
+        self.interval = app.config.get('RUN_POLL_INTERVAL', self.interval)
+        self.backend  = get_backend(app.config.get('RUN_BACKEND','local'),
+                                    max_cores = app.config.get('RUN_MAX_CORES'),
+                                    interval  = app.config.get('SLURM_POLL_INTERVAL',30.0))
+
+    @property
+    def max_cores(self):
+        return getattr(self.backend,'max_cores',None)
+
+    def submit(self,p,path,script,**kwargs):
+        """Queue a batch script and return the job immediately."""
+        from app.extensions import db
+        from app.run.models import Jobs
+        job = Jobs(profile=p, path=path, script=script, backend=self.backend.name, **kwargs)
+        db.session.add(job)
+        db.session.commit()
+        self.start()
+        self._wakeup.set()
+        return job
+
+    def cancel(self,job):
+        """Cancel a queued job or ask the backend to stop a submitted one."""
+        from app.extensions import db
+        from app.run.models import Jobs
+        if job.status == 'queued':
+            n = Jobs.query.filter_by(id=job.id, status='queued').update({'status': 'cancelled',
+                                                                          'finished': datetime.now()})
+            db.session.commit()
+            if n:
+                return True
+            db.session.refresh(job)
+        if job.status in ('pending','running'):
+            with self._lock:
+                if not self.backend.cancel(job):
+                    return False
+            # The end time is recorded when the backend reports the job done
+            job.status = 'cancelled'
+            db.session.commit()
+            self._wakeup.set()
+            return True
+        return False
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    with self._lock:
+                        self._submit()
+                        self._poll()
+            except Exception as e:
+                print(f"Job runner error: {e}")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def _submit(self):
+        """Hand the queued jobs to the backend."""
+        from app.extensions import db
+        from app.run.models import Jobs
+        for job in Jobs.query.filter_by(status='queued', backend=self.backend.name).order_by(Jobs.id).all():
+            # Claim the job (another process may be submitting too)
+            n = Jobs.query.filter_by(id=job.id, status='queued').update({'status': 'pending'})
+            db.session.commit()
+            if not n:
+                continue
+            db.session.refresh(job)
+            try:
+                self.backend.submit(job)
+            except Exception as e:
+                job.status   = 'failed'
+                job.finished = datetime.now()
+                print(f"Job {job.id} submission failed: {e}")
+            db.session.commit()
+
+    def _poll(self):
+        """Apply the status changes of the active jobs."""
+        from app.extensions import db
+        from app.run.models import Jobs
+        active = Jobs.query.filter(Jobs.backend == self.backend.name,
+                                   Jobs.status.in_(('pending','running','cancelled')),
+                                   Jobs.finished.is_(None)).all()
+        if not active:
+            return
+        changes = self.backend.poll(active)
+        for job in active:
+            values = changes.get(job.id)
+            if not values:
+                continue
+            if job.status == 'cancelled' and values.get('status') not in Jobs.FINAL:
+                # The backend may not have seen the cancellation yet
+                values.pop('status',None)
+            for k, v in values.items():
+                setattr(job,k,v)
+        db.session.commit()
+
+runner = JobRunner()
@@ -0,0 +1,142 @@
+import os
+import re
+import glob
+from datetime import datetime, timedelta
+
+# FALL3D simulated time, as hours after 00 or as a date (e.g. 29Apr2008_06:30:00)
+TIME_LINE  = re.compile(r'(?:current|simulation|model)\s+time\b[^:=]*[:=]\s*(.+)', re.IGNORECASE)
+STAMP      = re.compile(r'(\d{1,2})[-\s]?([A-Za-z]{3})[-\s]?(\d{4})[_\sT-]+(\d{1,2}):(\d{2})(?::(\d{2}))?')
+ISO_STAMP  = re.compile(r'(\d{4})-(\d{2})-(\d{2})[_\sT]+(\d{1,2}):(\d{2})(?::(\d{2}))?')
+CLOCK      = re.compile(r'(\d+):(\d{2})(?::(\d{2}))?')
+NUMBER     = re.compile(r'([-+]?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)\s*(\(?\s*(?:s|sec|min|h|hours?)\b)?')
+
+def tail(fname,offset=0,max_bytes=2**20):
+    """Complete lines of a file from a byte offset.
+
+    Returns (lines, offset of the first unread byte). Only whole lines
+    are returned, so a line being written is read on the next call. A
+    file smaller than the offset (rewritten) is read from the start.
+    """
+    with open(fname,'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if offset > size:
+            offset = 0
+        f.seek(offset)
+        data = f.read(max_bytes)
+    end = data.rfind(b'\n')
+    if end < 0:
+        if len(data) < max_bytes:
+            return [], offset
+        # A line longer than max_bytes
+        end = len(data) - 1
+    data = data[:end+1]
+    return data.decode(errors='replace').splitlines(), offset + len(data)
+
+def tail_start(fname,window=64*2**10):
+    """Offset of the first whole line of the last `window` bytes of a file."""
+    size = os.path.getsize(fname)
+    if size <= window:
+        return 0
+    with open(fname,'rb') as f:
+        f.seek(size - window)
+        skip = f.readline()
+    return size - window + len(skip)
+
+def job_logs(job):
+    """Log files of a job ({path relative to the job folder: path}).
+
+    The FALL3D logs of the job folder (and of the member folders of a
+    sweep) and the batch stdout/stderr, including those of array tasks.
+    """
+    patterns = [os.path.join(job.path,'*.log'),
+                os.path.join(job.path,'[0-9][0-9][0-9][0-9]','*.log')]
+    for fname in (job.stdout, job.stderr):
+        if fname:
+            patterns.append(fname.replace('%a','*'))
+            (root, ext) = os.path.splitext(fname)
+            patterns.append(f'{root}_*{ext}')
+    files = {}
+    for pattern in patterns:
+        for fname in glob.glob(pattern):
+            files[os.path.relpath(fname,job.path)] = fname
+    return dict(sorted(files.items()))
+
+def run_window(path):
+    """Day and RUN_START/RUN_END (hours after 00) of the config.inp of a run folder."""
+    fname = os.path.join(path,'config.inp')
+    values = {}
+    try:
+        with open(fname) as f:
+            for line in f:
+                (key, _, value) = line.partition('=')
+                values[key.strip()] = value.strip()
+        day = datetime(int(values['YEAR']),int(values['MONTH']),int(values['DAY']))
+        return day, float(values['RUN_START_(HOURS_AFTER_00)']), float(values['RUN_END_(HOURS_AFTER_00)'])
+    except (OSError, KeyError, ValueError):
+        return None
+
+class Progress:
+    """Progress of a FALL3D run from the simulated time found in its log.
+
+    The simulated time is compared with RUN_START/RUN_END of the config
+    file; the ETA extrapolates the wall time elapsed since the start.
+    """
+    def __init__(self,day,start,end):
+        self.day   = day
+        self.start = start
+        self.end   = end
+        self.hours = None
+
+    @classmethod
+    def for_log(cls,fname):
+        window = run_window(os.path.dirname(fname))
+        return cls(*window) if window else None
+
+    def parse(self,value):
+        """Hours after 00 of a simulated time."""
+        m = STAMP.search(value)
+        if m:
+            (d, mon, y, h, mi, s) = m.groups()
+            t = datetime.strptime(f'{d} {mon} {y}', '%d %b %Y') + \
+                timedelta(hours=int(h), minutes=int(mi), seconds=int(s or 0))
+            return (t - self.day).total_seconds()/3600
+        m = ISO_STAMP.search(value)
+        if m:
+            (y, mon, d, h, mi, s) = (int(x or 0) for x in m.groups())
+            t = datetime(y,mon,d,h,mi,s)
+            return (t - self.day).total_seconds()/3600
+        m = CLOCK.match(value)
+        if m:
+            (h, mi, s) = (int(x or 0) for x in m.groups())
+            return h + mi/60 + s/3600
+        m = NUMBER.match(value)
+        if m:
+            unit = (m.group(2) or 'h').strip('( ').lower()
+            scale = {'s': 1/3600, 'sec': 1/3600, 'min': 1/60}.get(unit,1)
+            return float(m.group(1))*scale
+        return None
+
+    def update(self,lines):
+        """Parse new log lines; True if the simulated time changed."""
+        changed = False
+        for line in lines:
+            m = TIME_LINE.search(line)
+            if m is None:
+                continue
+            hours = self.parse(m.group(1))
+            if hours is not None and hours != self.hours:
+                self.hours = hours
+                changed = True
+        return changed
+
+    def to_dict(self,started=None):
+        if self.hours is None or self.end <= self.start:
+            return {'percent': None}
+        fraction = min(max((self.hours - self.start)/(self.end - self.start),0.0),1.0)
+        out = {'hours':   self.hours,
+               'percent': 100*fraction,
+               'eta':     None}
+        if started is not None and 0 < fraction < 1:
+            elapsed = (datetime.now() - started).total_seconds()
+            out['eta'] = elapsed*(1 - fraction)/fraction
+        return out
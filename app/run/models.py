@@ -1,5 +1,9 @@
 from app.extensions import db
-from sqlalchemy.orm import Mapped, mapped_column
+from app.models import Profiles
+from sqlalchemy import ForeignKey
+from sqlalchemy.orm import Mapped, mapped_column, relationship, backref
+from typing import Optional
+from datetime import datetime
 
 class RunModel(db.Model):
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -7,3 +11,62 @@ class RunModel(db.Model):
     f2: Mapped[int] = mapped_column(default=1, info={'label': 'NY'})
     f3: Mapped[int] = mapped_column(default=1, info={'label': 'NZ'})
     f4: Mapped[int] = mapped_column(default=1, info={'label': 'NENS'})
+    f5: Mapped[str] = mapped_column(default='00:10:00', info={'label': 'TIME_LIMIT'})
+
+class Jobs(db.Model):
+    """A FALL3D run launched from the web application."""
+    id:         Mapped[int] = mapped_column(primary_key=True)
+    p_id:       Mapped[int] = mapped_column(ForeignKey(Profiles.id, ondelete='CASCADE'), index=True)
+    # Deleted with the profile (SQLite doesn't enforce ON DELETE CASCADE)
+    profile:    Mapped[Profiles] = relationship(backref=backref('jobs', cascade='all, delete-orphan'))
+    # queued, pending (submitted), running, finished, failed, timeout or cancelled
+    status:     Mapped[str] = mapped_column(default='queued', index=True)
+    path:       Mapped[str]
+    script:     Mapped[str]
+    backend:    Mapped[str] = mapped_column(default='local')
+    scheduler_id: Mapped[Optional[str]]
+    ncores:     Mapped[int] = mapped_column(default=1)
+    time_limit: Mapped[Optional[int]]
+    array_size: Mapped[Optional[int]]
+    pid:        Mapped[Optional[int]]
+    # Decomposition (NXxNYxNZxNENS), grid cells (nxxnyxnz) and simulated
+    # hours of single runs, used to fit the decomposition cost model
+    layout:     Mapped[Optional[str]]
+    grid:       Mapped[Optional[str]]
+    sim_hours:  Mapped[Optional[float]]
+    exit_code:  Mapped[Optional[int]]
+    stdout:     Mapped[Optional[str]]
+    stderr:     Mapped[Optional[str]]
+    submitted:  Mapped[datetime] = mapped_column(default=datetime.now)
+    started:    Mapped[Optional[datetime]]
+    finished:   Mapped[Optional[datetime]]
+
+    FINAL = ('finished', 'failed', 'timeout', 'cancelled')
+
+    @property
+    def done(self):
+        return self.status in self.FINAL
+
+    def to_dict(self):
+        return {'id':        self.id,
+                'profile':   self.profile.label if self.profile else None,
+                'status':    self.status,
+                'path':      self.path,
+                'script':    self.script,
+                'backend':   self.backend,
+                'scheduler_id': self.scheduler_id,
+                'ncores':    self.ncores,
+                'time_limit': self.time_limit,
+                'array_size': self.array_size,
+                'layout':    self.layout,
+                'grid':      self.grid,
+                'pid':       self.pid,
+                'exit_code': self.exit_code,
+                'stdout':    self.stdout,
+                'stderr':    self.stderr,
+                'submitted': self.submitted.isoformat() if self.submitted else None,
+                'started':   self.started.isoformat()   if self.started   else None,
+                'finished':  self.finished.isoformat()  if self.finished  else None}
+
+    def __repr__(self):
+        return '<Job {} {}>'.format(self.id, self.status)
@@ -1,9 +1,18 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, session, current_app
+from flask import Blueprint, render_template, redirect, url_for, flash, session, current_app, abort, request, Response
 from app.models import Profiles
-from app.run.models import RunModel
-from app.run.forms import RunForm
+from app.run.models import RunModel, Jobs
+from app.run.forms import RunForm, SweepForm
+from app.run.jobs import runner
+from app.run.sweep import parse_sweep, cartesian, latin_hypercube, write_sweep
+from app.run.logs import tail, tail_start, job_logs, Progress
+from app.run.decomposition import grid_cells, advise, job_records, CostModel
+from app.run.tasks import task_list
 from app.profiles import profile_required
+from app.extensions import db
 import os
+import json
+import time
+import random
 
 bp = Blueprint('run', __name__)
 
@@ -14,7 +23,9 @@ def index():
     p = Profiles.query.get_or_404(id)
     run_folder = os.path.join(current_app.config['RUN_FOLDER'],p.label)
     form = RunForm()
-    if form.validate_on_submit():
+    cells = grid_cells(get_section(p,'GRID'))
+    cores = available_cores()
+    if form.validate_on_submit() and form.check_layout(cells,cores):
         if os.path.exists(run_folder):
             flash("Folder already exists")
         else:
@@ -24,10 +35,45 @@ def index():
             except:
                 return "Fatall"
         render_files(run_folder,p.sections,form)
-#        res = run_script(run_folder)
+        job = run_script(p,run_folder,form)
+        flash(f"Job {job.id} queued")
+        return redirect(url_for('run.jobs'))
+    model = cost_model()
     return render_template('run/index.html',
                            sections = p.sections,
-                           form     = form)
+                           form     = form,
+                           cells    = cells,
+                           cores    = cores,
+                           model    = model,
+                           advice   = advise(cells,cores,form.f4.data or 1,model) if cores else [])
+
+def get_section(p,label):
+    return next(s for s in p.sections if s.label == label)
+
+def available_cores():
+    """Cores a run can use (RUN_AVAILABLE_CORES, else the limit of the local
+    backend). None if unknown: the cores of the web host say nothing of
+    those of a batch scheduler."""
+    return current_app.config.get('RUN_AVAILABLE_CORES') or runner.max_cores
+
+def cost_model():
+    """Decomposition cost model fitted on the finished runs."""
+    return CostModel.fit(job_records(Jobs.query.filter_by(status='finished')))
+
+@bp.route('/advise')
+@profile_required
+def advise_layout():
+    """Recommended decompositions of the profile grid (JSON)."""
+    p = Profiles.query.get_or_404(session['id'])
+    cells = grid_cells(get_section(p,'GRID'))
+    cores = request.args.get('cores', type=int) or available_cores()
+    nens  = request.args.get('nens', 1, type=int)
+    model = cost_model()
+    return {'cells':   cells,
+            'cores':   cores,
+            'model':   {'a': model.a, 'b': model.b, 'c': model.c,
+                        'fitted': model.fitted, 'samples': model.samples},
+            'layouts': advise(cells,cores,nens,model,top=request.args.get('top',5,type=int)) if cores else []}
 
 def render_files(path,sections,form):
     flash("Writing configuration file")
@@ -43,16 +89,224 @@ def render_files(path,sections,form):
     with open(fname,"w") as f:
         parsed_template = render_template(
                 'run/launch.sh',
-                form = form,
-                path = path)
+                path = path,
+                **launch_args(form),
+                **task_args(path,sections,form.f4.data))
         f.write(parsed_template)
     os.chmod(fname,0o774)
 
-def run_script(path):
-    import subprocess
-    fname = os.path.join(path,"launch.sh")
-    print("+++++++launching")
-    flash("Running...")
-    p = subprocess.Popen([fname])
-    print("+++++++stop")
-    return p
+def launch_args(form):
+    """Variables of the launching script from the run form."""
+    fields = [form[c.name] for c in RunModel.__table__.columns if c.name in form]
+    return {'fields':  [(field.label.text,field.data) for field in fields],
+            'ntasks':  form.f1.data * form.f2.data * form.f3.data * form.f4.data,
+            'time':    form.f5.data,
+            'options': current_app.config.get('RUN_SBATCH_OPTIONS',[])}
+
+def task_cache():
+    return current_app.config.get('RUN_TASK_CACHE') or \
+           os.path.join(current_app.config['RUN_FOLDER'],'.taskcache')
+
+def task_args(path,sections,nens=1):
+    """FALL3D tasks of the launching script with their fingerprints.
+
+    Ensembles (NENS > 1) run all the tasks at once.
+    """
+    exe = current_app.config.get('FALL3D_EXE')
+    args = {'exe': exe, 'cache': task_cache(), 'tasks': []}
+    if nens == 1:
+        args['tasks'] = task_list(sections,path,exe)
+    return args
+
+def render_array(path,folders,ntasks,time,name='FALL3D'):
+    """Write a job array script running the launching script of each folder."""
+    fname = os.path.join(path,"launch_array.sh")
+    with open(fname,"w") as f:
+        parsed_template = render_template(
+                'run/launch_array.sh',
+                folders = folders,
+                ntasks  = ntasks,
+                time    = time,
+                name    = name,
+                options = current_app.config.get('RUN_SBATCH_OPTIONS',[]))
+        f.write(parsed_template)
+    os.chmod(fname,0o774)
+    return fname
+
+def run_script(p,path,form):
+    """Queue the launching script of a run folder (returns immediately)."""
+    time_utc = get_section(p,'TIME_UTC')
+    return runner.submit(p,path,os.path.join(path,"launch.sh"),
+                         layout    = f"{form.f1.data}x{form.f2.data}x{form.f3.data}x{form.f4.data}",
+                         grid      = 'x'.join(str(n) for n in grid_cells(get_section(p,'GRID'))),
+                         sim_hours = time_utc.f3 - time_utc.f2)
+
+@bp.route('/sweep', methods = ["GET","POST"])
+@profile_required
+def sweep():
+    p = Profiles.query.get_or_404(session['id'])
+    form = SweepForm()
+    if form.validate_on_submit() and form.check_layout(grid_cells(get_section(p,'GRID')),available_cores()):
+        seed = form.seed.data if form.seed.data is not None else random.randrange(2**31)
+        try:
+            params = parse_sweep(form.parameters.data,p.sections)
+            if form.method.data == 'lhs':
+                if not form.samples.data:
+                    raise ValueError("the number of samples is required")
+                samples = latin_hypercube(params,form.samples.data,seed)
+            else:
+                samples = cartesian(params)
+                seed = None
+        except ValueError as e:
+            flash(f"Invalid sweep: {e}")
+            return render_template('run/sweep.html', form=form)
+        path = os.path.join(current_app.config['RUN_FOLDER'],p.label,'sweeps',form.name.data)
+        if len(samples) > current_app.config.get('SWEEP_MAX_MEMBERS',1000):
+            flash(f"Too many members: {len(samples)}")
+        elif os.path.exists(path):
+            flash("Sweep already exists")
+        else:
+            env = current_app.jinja_env
+            args = launch_args(form)
+            (exe, cache) = (current_app.config.get('FALL3D_EXE'), task_cache())
+            def member_args(folder,sections):
+                tasks = task_list(sections,folder,exe) if form.f4.data == 1 else []
+                return dict(args, exe=exe, cache=cache, tasks=tasks)
+            folders = write_sweep(path,p.sections,params,samples,
+                                  env.get_template('run/config.inp'),
+                                  env.get_template('run/launch.sh'),
+                                  launch_args = member_args,
+                                  method      = form.method.data,
+                                  seed        = seed,
+                                  max_workers = current_app.config.get('SWEEP_WORKERS',8))
+            flash(f"Created {len(folders)} run folders in {path}")
+            if not form.array.data:
+                return redirect(url_for('run.sweep'))
+            script = render_array(path,folders,args['ntasks'],args['time'],name=form.name.data)
+            job = runner.submit(p,path,script)
+            flash(f"Job {job.id} queued")
+            return redirect(url_for('run.jobs'))
+    return render_template('run/sweep.html', form=form)
+
+@bp.route('/jobs')
+def jobs():
+    runner.start()
+    jobs = Jobs.query.order_by(Jobs.id.desc()).all()
+    return render_template('run/jobs.html', jobs=jobs)
+
+@bp.route('/jobs/status')
+def jobs_status():
+    """Status of every job (JSON)."""
+    runner.start()
+    return {'backend':   runner.backend.name,
+            'max_cores': runner.max_cores,
+            'jobs': [j.to_dict() for j in Jobs.query.order_by(Jobs.id.desc())]}
+
+@bp.route('/jobs/<int:id>')
+def job_status(id):
+    runner.start()
+    return db.get_or_404(Jobs,id).to_dict()
+
+@bp.route('/jobs/<int:id>/cancel', methods = ['POST'])
+def job_cancel(id):
+    job = db.get_or_404(Jobs,id)
+    if runner.cancel(job):
+        flash(f"Job {id} cancelled")
+    else:
+        flash(f"Job {id} cannot be cancelled")
+    return redirect(url_for('run.jobs'))
+
+def get_log(job,name):
+    fname = job_logs(job).get(name)
+    if fname is None:
+        abort(404)
+    return fname
+
+def read_log(fname,offset):
+    """New lines of a log and the progress of the run (None: unknown)."""
+    if offset is None:
+        offset = tail_start(fname,current_app.config.get('LOG_TAIL_WINDOW',64*2**10))
+    return tail(fname,offset,current_app.config.get('LOG_CHUNK',2**20))
+
+def log_progress(fname):
+    """Progress of a run from the last simulated time in the tail of its log."""
+    progress = Progress.for_log(fname)
+    if progress is not None:
+        window = current_app.config.get('LOG_TAIL_WINDOW',64*2**10)
+        try:
+            progress.update(tail(fname,tail_start(fname,window),window)[0])
+        except OSError:
+            pass
+    return progress
+
+@bp.route('/jobs/<int:id>/logs')
+def job_logs_view(id):
+    job = db.get_or_404(Jobs,id)
+    return render_template('run/logs.html', job=job, logs=list(job_logs(job)))
+
+@bp.route('/jobs/<int:id>/log/<path:name>')
+def job_log(id,name):
+    """Lines of a log from a byte offset (default: the end of the file)."""
+    job = db.get_or_404(Jobs,id)
+    fname = get_log(job,name)
+    (lines, offset) = read_log(fname,request.args.get('offset',type=int))
+    out = {'lines': lines, 'offset': offset}
+    progress = log_progress(fname)
+    if progress is not None and progress.hours is not None:
+        # Only when known, so that clients keep the last value
+        out['progress'] = progress.to_dict(job.started)
+    return out
+
+@bp.route('/jobs/<int:id>/log/<path:name>/stream')
+def job_log_stream(id,name):
+    """Server-sent events with the lines appended to a log.
+
+    Each event carries the offset reached as its id, so a reconnecting
+    client resumes where it stopped (Last-Event-ID). The stream ends when
+    the job is done and the log has been read.
+    """
+    job = db.get_or_404(Jobs,id)
+    fname = get_log(job,name)
+    offset = request.headers.get('Last-Event-ID', type=int)
+    if offset is None:
+        offset = request.args.get('offset', type=int)
+    started = job.started
+    interval = current_app.config.get('RUN_POLL_INTERVAL',2.0)
+    window = current_app.config.get('LOG_TAIL_WINDOW',64*2**10)
+    chunk = current_app.config.get('LOG_CHUNK',2**20)
+    app = current_app._get_current_object()
+    progress = log_progress(fname)
+    def stream(offset):
+        yield 'retry: 5000\n\n'
+        if progress is not None and progress.hours is not None:
+            # Known progress, also when resuming past the last time line
+            yield f"event: progress\ndata: {json.dumps(progress.to_dict(started))}\n\n"
+        if offset is None:
+            offset = tail_start(fname,window)
+        idle = 0.0
+        while True:
+            # Checked before reading, so the last lines are not missed
+            with app.app_context():
+                done = db.session.get(Jobs,id).done
+            try:
+                (lines, offset) = tail(fname,offset,chunk)
+            except OSError:
+                lines = []
+            if lines:
+                idle = 0.0
+                yield f"id: {offset}\nevent: lines\ndata: {json.dumps(lines)}\n\n"
+                if progress is not None and progress.update(lines):
+                    yield f"event: progress\ndata: {json.dumps(progress.to_dict(started))}\n\n"
+                continue
+            if done:
+                yield "event: end\ndata: {}\n\n"
+                return
+            time.sleep(interval)
+            idle += interval
+            if idle >= 15:
+                idle = 0.0
+                yield ': keep-alive\n\n'
+    return Response(stream(offset),
+                    mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache',
+                             'X-Accel-Buffering': 'no'})
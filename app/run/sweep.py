@@ -0,0 +1,211 @@
+import os
+import json
+import random
+import itertools
+from datetime import date, datetime
+from concurrent.futures import ThreadPoolExecutor
+
+MANIFEST = 'manifest.json'
+
+class Parameter:
+    """A section field swept over a list of values or a range lo:hi[:n]."""
+    def __init__(self,name,section,column,values=None,bounds=None):
+        self.name    = name
+        self.section = section
+        self.column  = column
+        self.values  = values
+        self.bounds  = bounds
+        columns      = section.__table__.columns
+        self.type    = columns[column].type.python_type
+        # Column selecting between a value and keywords (e.g. ESTIMATE-MASTIN)
+        variable     = columns[column].info.get('variable')
+        self.selector = next((c.name for c in columns
+                              if c.name != column and c.info.get('variable') == variable
+                              and 'value' in c.info.get('options',[])), None)
+
+    def cast(self,value):
+        """Value of the type of the column (ranges are sampled as floats)."""
+        if self.type is date:
+            return date.fromordinal(int(round(value)))
+        if self.type is int:
+            return int(round(value))
+        return value
+
+    def levels(self):
+        """Values of a cartesian sweep."""
+        if self.values is not None:
+            return self.values
+        (lo, hi, n) = self.bounds
+        if n is None:
+            raise ValueError(f"{self.name}: the number of values of a range is required (lo:hi:n)")
+        if n == 1:
+            return [self.cast(lo)]
+        return [self.cast(lo + (hi-lo)*i/(n-1)) for i in range(n)]
+
+    def sample(self,u):
+        """Value at the quantile u (0 <= u < 1) of a Latin hypercube stratum."""
+        if self.values is not None:
+            return self.values[int(u*len(self.values))]
+        (lo, hi, _) = self.bounds
+        return self.cast(lo + (hi-lo)*u)
+
+def parse_value(kind,text):
+    if kind is date:
+        return date.fromisoformat(text)
+    if kind is bool:
+        return text.upper() in ('ON','YES','TRUE','1')
+    if kind is int:
+        return int(float(text))
+    if kind is float:
+        return float(text)
+    return text
+
+def parse_sweep(text,sections):
+    """Parameters of a sweep specification, one field per line:
+
+        SOURCE.f7   = 4000 6000 8000        (list of values)
+        SOURCE.f9   = 1e6:1e8:5             (range lo:hi:n)
+        TIME_UTC    = 2008-04-29 2008-04-30 (a section alone is its first field)
+
+    Fields can be given by column (f7) or by variable name. A swept value
+    with a keyword selector (e.g. MASS_FLOW_RATE_(KGS)) sets the selector
+    to 'value'. Lines starting with # are ignored.
+    """
+    by_label = {s.label: s for s in sections}
+    params = []
+    for line in text.splitlines():
+        line = line.split('#')[0].strip()
+        if not line:
+            continue
+        if '=' not in line:
+            raise ValueError(f"Missing '=' in: {line}")
+        (name, value) = (x.strip() for x in line.split('=',1))
+        (label, _, key) = name.partition('.')
+        section = by_label.get(label)
+        if section is None:
+            raise ValueError(f"Unknown section: {label}")
+        columns = section.__table__.columns
+        if not key:
+            column = next(name for (name, c) in columns.items() if c.info.get('variable'))
+        elif key in columns and columns[key].info.get('variable'):
+            column = key
+        else:
+            matches = [name for (name, c) in columns.items() if c.info.get('variable') == key]
+            if not matches:
+                raise ValueError(f"Unknown field: {name}")
+            # Values rather than keyword selectors
+            column = next((c for c in matches if 'options' not in columns[c].info), matches[0])
+        param = Parameter(f"{label}.{column}",section,column)
+        kind = param.type
+        try:
+            items = value.split(':')
+            if ' ' not in value and len(items) in (2,3) and kind in (int,float,date):
+                (lo, hi) = (parse_value(kind,x) for x in items[:2])
+                if kind is date:
+                    (lo, hi) = (lo.toordinal(), hi.toordinal())
+                n = int(items[2]) if len(items) == 3 else None
+                param.bounds = (float(lo), float(hi), n)
+            else:
+                param.values = [parse_value(kind,x) for x in value.split()]
+        except ValueError as e:
+            raise ValueError(f"{name}: {e}")
+        if param.values == []:
+            raise ValueError(f"{name}: no values")
+        params.append(param)
+    if len({p.name for p in params}) != len(params):
+        raise ValueError("Repeated field")
+    return params
+
+def cartesian(params):
+    """Every combination of the parameter values."""
+    levels = [p.levels() for p in params]
+    return [dict(zip((p.name for p in params),values)) for values in itertools.product(*levels)]
+
+def latin_hypercube(params,n,seed=None):
+    """n samples with one sample in each of the n strata of every parameter."""
+    rng = random.Random(seed)
+    columns = []
+    for p in params:
+        strata = list(range(n))
+        rng.shuffle(strata)
+        columns.append([p.sample((k + rng.random())/n) for k in strata])
+    return [dict(zip((p.name for p in params),values)) for values in zip(*columns)]
+
+class Rendered:
+    """Section formatted once, as seen by the config.inp template."""
+    def __init__(self,section):
+        self.section = section
+        self.label   = section.label
+        self.text    = str(section)
+
+    def __getattr__(self,name):
+        return getattr(self.section,name)
+
+    def __str__(self):
+        return self.text
+
+def override(section,values):
+    """Copy of a section with some fields replaced (the section is not modified)."""
+    copy = type(section)()
+    for c in section.__table__.columns:
+        if c.info.get('variable'):
+            setattr(copy,c.name,values.get(c.name,getattr(section,c.name)))
+    return Rendered(copy)
+
+def _jsonable(value):
+    return value.isoformat() if isinstance(value,(date,datetime)) else value
+
+def write_sweep(path,sections,params,samples,config,launch,
+                launch_args=None,method='cartesian',seed=None,max_workers=8):
+    """Write one run folder per sample (0000, 0001, ...) and a manifest.
+
+    config and launch are compiled templates rendered for every member;
+    the sections that are not swept are formatted only once. launch_args
+    are the variables of the launching script, or a function of the
+    member folder and sections returning them. Folders are written by a
+    pool of threads. Returns the list of member folders.
+    """
+    swept = {p.section.label for p in params}
+    common = {s.label: Rendered(s) for s in sections if s.label not in swept}
+    members = []
+    for i, sample in enumerate(samples):
+        fields = {}
+        for p in params:
+            fields.setdefault(p.section.label,{})[p.column] = sample[p.name]
+        for p in params:
+            if p.selector and f"{p.section.label}.{p.selector}" not in sample:
+                fields[p.section.label][p.selector] = 'value'
+        items = [common.get(s.label) or override(s,fields[s.label])
+                 for s in sections]
+        members.append((os.path.join(path,f'{i:04d}'),items))
+
+    def write(member):
+        (folder, items) = member
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder,'config.inp'),'w') as f:
+            f.write(config.render(sections=items))
+        fname = os.path.join(folder,'launch.sh')
+        args = launch_args(folder,items) if callable(launch_args) else launch_args
+        with open(fname,'w') as f:
+            f.write(launch.render(path=folder, **(args or {})))
+        os.chmod(fname,0o774)
+        return folder
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        folders = list(executor.map(write,members))
+
+    manifest = {'created':    datetime.now().isoformat(),
+                'method':     method,
+                'seed':       seed,
+                'parameters': {p.name: {'variable': p.section.__table__.columns[p.column].info['variable'],
+                                        'values':   [_jsonable(v) for v in p.values] if p.values else None,
+                                        'range':    [_jsonable(p.cast(x)) for x in p.bounds[:2]]
+                                                    if p.bounds else None}
+                               for p in params},
+                'members':    [{'id':     i,
+                                'path':   folder,
+                                'values': {k: _jsonable(v) for k, v in sample.items()}}
+                               for i, (folder, sample) in enumerate(zip(folders,samples))]}
+    with open(os.path.join(path,MANIFEST),'w') as f:
+        json.dump(manifest,f,indent=1)
+    return folders
@@ -0,0 +1,77 @@
+import os
+import hashlib
+
+class Task:
+    """A FALL3D task: the sections and input files it reads, its outputs
+    (glob patterns, {name} is the input file name without extension) and
+    the tasks whose outputs it reads.
+
+    sections None stands for every section. Outputs starting with '?' are
+    optional: kept when written, but their absence is not a failure.
+    """
+    def __init__(self,name,sections,files,outputs,after=()):
+        self.name     = name
+        self.sections = sections
+        self.files    = files
+        self.outputs  = outputs
+        self.after    = after
+
+TASKS = [Task('SetTgsd', ['SPECIES','TEPHRA_TGSD'],
+                         [],
+                         ['{name}.*.tgsd']),
+         Task('SetDbs',  ['TIME_UTC','METEO_DATA','GRID'],
+                         [('METEO_DATA','f2'), ('METEO_DATA','f3'), ('METEO_DATA','f5')],
+                         ['{name}.dbs.nc', '{name}.dbs.pro']),
+         Task('SetSrc',  ['TIME_UTC','GRID','SPECIES','PARTICLE_AGGREGATION','SOURCE'],
+                         [],
+                         ['{name}.src', '{name}.grn'],
+                         after=('SetTgsd','SetDbs')),
+         Task('FALL3D',  None,
+                         [('TIME_UTC','f5'), ('MODEL_OUTPUT','f19')],
+                         ['{name}.res.nc', '?{name}.rst.nc'],
+                         after=('SetDbs','SetSrc'))]
+
+def file_id(path,fname):
+    """Identity of an input file relative to a run folder (path, size, mtime)."""
+    if not fname:
+        return 'none'
+    try:
+        st = os.stat(os.path.join(path,fname))
+    except OSError:
+        # As written, so runs in different folders share the fingerprint
+        return f'{fname}:missing'
+    return f'{os.path.realpath(os.path.join(path,fname))}:{st.st_size}:{st.st_mtime_ns}'
+
+def fingerprints(sections,path,exe=None):
+    """Fingerprint of every task ({task: sha256 hex}).
+
+    A task fingerprint covers the text of the sections the task reads
+    (as written to config.inp), the identity of its input files, the
+    fingerprints of the tasks it depends on and the FALL3D executable.
+    Files are identified by size and modification time, so large
+    meteorological files are not read.
+    """
+    by_label = {s.label: s for s in sections}
+    exe_id = file_id('/',exe) if exe else 'none'
+    out = {}
+    for task in TASKS:
+        h = hashlib.sha256()
+        h.update(f'{task.name}\n{exe_id}\n'.encode())
+        labels = sorted(by_label) if task.sections is None else task.sections
+        for label in labels:
+            if label in by_label:
+                h.update(f'[{label}]\n{by_label[label]}\n'.encode())
+        for (label, column) in task.files:
+            section = by_label.get(label)
+            value = getattr(section,column,None) if section is not None else None
+            h.update(f'{label}.{column}={file_id(path,value)}\n'.encode())
+        for name in task.after:
+            h.update(f'{name}={out[name]}\n'.encode())
+        out[task.name] = h.hexdigest()
+    return out
+
+def task_list(sections,path,exe=None,name='config'):
+    """(task, fingerprint, output patterns) in execution order."""
+    fps = fingerprints(sections,path,exe)
+    return [(task.name, fps[task.name], [o.format(name=name) for o in task.outputs])
+            for task in TASKS]
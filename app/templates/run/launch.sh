@@ -3,25 +3,84 @@
 #SBATCH --output=%x_%j.out
 #SBATCH --error=%x_%j.err
 #SBATCH --nodes=1
-#SBATCH --ntasks=20
-#SBATCH --time=00:10:00
-#SBATCH --qos=training
-#SBATCH --reservation=Computational24
-
+#SBATCH --ntasks={{ntasks}}
+{% if time -%}
+#SBATCH --time={{time}}
+{% endif -%}
+{% for option in options -%}
+#SBATCH {{option}}
+{% endfor %}
 #module purge
 #module load intel/2017.4
 #module load impi/2017.4
 #module load netcdf
 
 RUNDIR={{path}}
-EXEDIR=/home/lmingari/fall3d/fall3d/build3/Fall3d.r8.x
+EXEDIR={{exe}}
 INPFILE="config.inp"
 TASK="all"
 
-{% for field in form if field.widget.input_type != 'hidden' -%}
-{{field.label.text}}={{field.data}}
+{% for label, value in fields -%}
+{{label}}={{value}}
 {% endfor %}
 NP=$((NX*NY*NZ*NENS))
 
 cd $RUNDIR
+{% if tasks %}
+CACHE={{cache}}
+
+# Output files matching the patterns (fails if a pattern matches nothing,
+# unless it is optional: ?pattern)
+outputs() {
+    local p
+    for p in "$@"; do
+        if [ "${p:0:1}" == "?" ]; then
+            compgen -G "${p:1}"
+        else
+            compgen -G "$p" || return 1
+        fi
+    done
+    return 0
+}
+
+# Run a task unless its outputs for the same fingerprint are already in
+# the run folder or in the task cache (hard-linked, else copied)
+run_task() {
+    local task=$1 fp=$2 files f
+    shift 2
+    local cached=$CACHE/$task/$fp
+    mkdir -p .tasks
+    if [ "$(cat .tasks/$task 2>/dev/null)" == "$fp" ] && outputs "$@" > /dev/null; then
+        echo "$task: up to date"
+        return 0
+    fi
+    if [ -f $cached/.done ]; then
+        for f in $cached/*; do
+            rm -f $(basename $f)
+            ln $f . 2>/dev/null || cp $f .
+        done
+        echo $fp > .tasks/$task
+        echo "$task: reused $cached"
+        return 0
+    fi
+    # Unlink old outputs, which may be shared with the cache
+    for f in "$@"; do rm -f ${f#\?}; done
+    rm -f .tasks/$task
+    mpirun -np ${NP} ${EXEDIR} $task ${INPFILE} ${NX} ${NY} ${NZ} || return 1
+    files=$(outputs "$@") || return 1
+    mkdir -p $cached.$$
+    for f in $files; do
+        ln $f $cached.$$/ 2>/dev/null || cp $f $cached.$$/
+    done
+    touch $cached.$$/.done
+    mv -T $cached.$$ $cached 2>/dev/null || rm -rf $cached.$$
+    echo $fp > .tasks/$task
+    echo "$task: done"
+}
+
+{% for task, fp, outputs in tasks -%}
+run_task {{task}} {{fp}} {% for o in outputs %}"{{o}}" {% endfor %}|| exit 1
+{% endfor %}
+{%- else %}
 mpirun -np ${NP} ${EXEDIR} ${TASK} ${INPFILE} ${NX} ${NY} ${NZ} -nens ${NENS}
+{%- endif %}
@@ -0,0 +1,22 @@
+#!/bin/bash
+#SBATCH --job-name={{name}}
+#SBATCH --output=%x_%A_%a.out
+#SBATCH --error=%x_%A_%a.err
+#SBATCH --nodes=1
+#SBATCH --ntasks={{ntasks}}
+{% if time -%}
+#SBATCH --time={{time}}
+{% endif -%}
+#SBATCH --array=0-{{folders|length - 1}}
+{% for option in options -%}
+#SBATCH {{option}}
+{% endfor %}
+# One task per run folder, each with its own launching script
+FOLDERS=(
+{% for folder in folders -%}
+{{folder}}
+{% endfor -%}
+)
+
+cd ${FOLDERS[$SLURM_ARRAY_TASK_ID]}
+bash launch.sh
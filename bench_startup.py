@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""Cold start benchmark of the web application and the flask CLI.
+
+Each command runs in a fresh interpreter several times and the median
+wall time is compared with the target. It also checks that the
+scientific stack is not imported at startup. Exits with status 1 if a
+check fails.
+
+    python bench_startup.py [--repeat 5] [--target 1.5]
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+import statistics
+
+# Modules that must only be loaded on first use (plots, volcano list)
+HEAVY = ('xarray', 'matplotlib', 'cartopy', 'pandas', 'netCDF4', 'shapely')
+
+COMMANDS = {
+    'app': [sys.executable, '-c', 'from app import create_app; create_app()'],
+    'cli': [sys.executable, '-m', 'flask', '--app', 'app', 'db', '--help'],
+    }
+
+CHECK = ("import sys\n"
+         "from app import create_app\n"
+         "create_app()\n"
+         f"print(' '.join(m for m in {HEAVY!r} if m in sys.modules))\n")
+
+def timeit(cmd,repeat):
+    times = []
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter()-t0)
+    return statistics.median(times)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int,   default=5)
+    parser.add_argument('--target', type=float, default=1.5,
+                        help="maximum median startup time in seconds")
+    args = parser.parse_args()
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    ok = True
+    for name, cmd in COMMANDS.items():
+        elapsed = timeit(cmd,args.repeat)
+        status  = 'OK' if elapsed <= args.target else 'SLOW'
+        ok     &= elapsed <= args.target
+        print(f"{name:4s} {elapsed:6.3f} s  (target {args.target:.3f} s)  {status}")
+
+    loaded = subprocess.run([sys.executable, '-c', CHECK], check=True,
+                            capture_output=True, text=True).stdout.split()
+    if loaded:
+        ok = False
+        print(f"Heavy modules imported at startup: {', '.join(loaded)}")
+    sys.exit(0 if ok else 1)
+
+if __name__ == '__main__':
+    main()
@@ -7,3 +7,71 @@ class Config:
     SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     RUN_FOLDER = '/home/lmingari/fall3d/flask'
+
+    # Batch backend of the runs: 'local' (processes on this host limited
+    # to RUN_MAX_CORES, None: all cores) or 'slurm' (sbatch, with the
+    # queue checked every SLURM_POLL_INTERVAL seconds). RUN_POLL_INTERVAL
+    # is the period of the job runner.
+    RUN_BACKEND         = 'local'
+    RUN_MAX_CORES       = None
+    RUN_POLL_INTERVAL   = 2.0
+    SLURM_POLL_INTERVAL = 30.0
+
+    # Cores a single run can use, checked by the decomposition advisor
+    # (None: RUN_MAX_CORES or all cores for the local backend, else not
+    # checked)
+    RUN_AVAILABLE_CORES = None
+
+    # FALL3D executable and folder of the task outputs shared by the runs
+    # (None: RUN_FOLDER/.taskcache)
+    FALL3D_EXE          = '/home/lmingari/fall3d/fall3d/build3/Fall3d.r8.x'
+    RUN_TASK_CACHE      = None
+
+    # Site-specific #SBATCH options of the launching scripts
+    RUN_SBATCH_OPTIONS  = ['--qos=training', '--reservation=Computational24']
+
+    # Bytes shown when opening a log and largest read of a log (bytes)
+    LOG_TAIL_WINDOW     = 64*2**10
+    LOG_CHUNK           = 2**20
+
+    # Threads writing the run folders of a sweep and largest sweep
+    SWEEP_WORKERS       = 8
+    SWEEP_MAX_MEMBERS   = 1000
+
+    # Rendered frames cache (bytes)
+    FRAMES_CACHE_MEMORY = 64*2**20
+    FRAMES_CACHE_DISK   = 512*2**20
+
+    # GeoJSON contours cache (bytes)
+    CONTOURS_CACHE_MEMORY = 16*2**20
+    CONTOURS_CACHE_DISK   = 256*2**20
+
+    # Number of processes used to pre-render frames (None: all cores)
+    PRERENDER_WORKERS = None
+    # Pre-rendering jobs (output and settings) whose progress is kept
+    PRERENDER_MAX_JOBS = 32
+    # Render workers are replaced after this number of frames or
+    # when their resident memory exceeds the limit (bytes)
+    RENDER_MAX_TASKS  = 200
+    RENDER_MAX_RSS    = 1024*2**20
+    # Start method of the render workers ('forkserver', 'spawn' or 'fork')
+    RENDER_START_METHOD = 'forkserver'
+
+    # Frames per second of exported animations
+    ANIMATION_FPS = 4
+
+    # Seconds between checks for new time steps in live mode
+    LIVE_POLL_INTERVAL = 2.0
+
+    # Number of renders kept by the metrics endpoint
+    METRICS_WINDOW = 1000
+    # Level of the per-render log lines (logger app.render)
+    RENDER_LOG_LEVEL = 'INFO'
+
+    # Open output datasets shared by all users
+    DATASETS_MAX_OPEN   = 16
+    DATASETS_MAX_MEMORY = 4*2**30
+    # Lazy mode reads only the requested time/variable slice;
+    # float32 halves the memory of float64 fields
+    DATASETS_LAZY       = True
+    DATASETS_FLOAT32    = False